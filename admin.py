@@ -0,0 +1,20 @@
+# admin.py
+from __future__ import annotations
+
+import os
+
+from telegram import Update
+
+
+def admin_chat_id() -> int:
+    """ADMIN_CHAT_ID, 0 if not set."""
+    return int(os.getenv("ADMIN_CHAT_ID", "0"))
+
+
+async def require_admin(update: Update) -> bool:
+    """True in the admin chat; anywhere else answers "Admin only." and returns False."""
+    admin = admin_chat_id()
+    if admin == 0 or update.effective_chat.id != admin:
+        await update.message.reply_text("Admin only.")
+        return False
+    return True
@@ -0,0 +1,130 @@
+# bench/fake_bot_api.py
+"""
+Local stand-in for api.telegram.org, just enough for the benchmarks:
+getMe, deleteWebhook, setWebhook, getUpdates (long poll) and sendMessage.
+Point a bot at it with ApplicationBuilder().base_url(api.base_url).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "crewbot", "username": "crewbot_test_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.server: asyncio.AbstractServer | None = None
+        self.port = 0
+        self.updates: list[dict] = []
+        self.update_event = asyncio.Event()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.webhook_url = ""
+        # (chat_id, text, monotonic time) for every sendMessage
+        self.sent: list[tuple[int, str, float]] = []
+        self.sent_event = asyncio.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+
+    # ---------------- updates ----------------
+    def make_update(self, chat_id: int, text: str) -> dict:
+        uid = self.next_update_id
+        self.next_update_id += 1
+        return {
+            "update_id": uid,
+            "message": {
+                "message_id": uid,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "user"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "user"},
+                "text": text,
+            },
+        }
+
+    def push_update(self, update: dict):
+        """Queues an update for getUpdates (polling mode)."""
+        self.updates.append(update)
+        self.update_event.set()
+
+    async def wait_sent(self, count: int, timeout: float = 30):
+        while len(self.sent) < count:
+            self.sent_event.clear()
+            await asyncio.wait_for(self.sent_event.wait(), timeout)
+
+    # ---------------- API methods ----------------
+    async def _call(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("deleteWebhook", "setWebhook"):
+            self.webhook_url = params.get("url", "")
+            return True
+        if method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates:
+                self.update_event.clear()
+                try:
+                    await asyncio.wait_for(self.update_event.wait(), float(params.get("timeout") or 0))
+                except asyncio.TimeoutError:
+                    pass
+            return list(self.updates)
+        if method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            self.sent.append((chat_id, params.get("text", ""), time.monotonic()))
+            self.sent_event.set()
+            mid = self.next_message_id
+            self.next_message_id += 1
+            return {
+                "message_id": mid,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = line.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+
+                if headers.get("content-type", "").startswith("application/json"):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+
+                method = target.rsplit("/", 1)[-1]
+                payload = json.dumps({"ok": True, "result": await self._call(method, params)}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
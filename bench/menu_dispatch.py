@@ -0,0 +1,121 @@
+# bench/menu_dispatch.py
+"""
+CPU cost per update on the hot `menu` path: dispatch, the chat_state read,
+building the sendMessage request (keyboard serialization included) and
+parsing the reply. The Bot API round trip is replaced by a canned
+in-process response, so only the bot's own work is measured.
+
+    python -m bench.menu_dispatch [--updates 5000]
+
+Also compares the reply_markup cost: a ReplyKeyboardMarkup built and
+serialized per reply (the old main_menu() path) vs the cached JSON string.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault("TOKEN", "123456:bench")
+
+from telegram import Bot, ReplyKeyboardMarkup, Update  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import crewbot  # noqa: E402
+
+BUTTONS = ["🌐 Website", "📧 Contact", "ℹ️ About CrewOnBoard", "📄 Apply Online", "hello"]
+
+SENT_MESSAGE = json.dumps({
+    "ok": True,
+    "result": {
+        "message_id": 1, "date": 0, "text": "x",
+        "chat": {"id": 42, "type": "private"},
+    },
+}).encode()
+
+
+class CannedRequest(BaseRequest):
+    """Answers every API call with a fixed sendMessage result."""
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if request_data is not None:
+            request_data.url_encoded_parameters()  # the encoding work a real request does
+        return 200, SENT_MESSAGE
+
+
+def make_update(bot: Bot, i: int, text: str) -> Update:
+    return Update.de_json({
+        "update_id": i,
+        "message": {
+            "message_id": i, "date": 0, "text": text,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "u"},
+        },
+    }, bot)
+
+
+def cpu_per_call(fn, n: int) -> float:
+    """µs of process CPU per await fn(i)."""
+    async def run():
+        for i in range(n):
+            await fn(i)
+
+    t0 = time.process_time()
+    asyncio.run(run())
+    return (time.process_time() - t0) / n * 1e6
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--updates", type=int, default=5000)
+    args = p.parse_args()
+    n = args.updates
+
+    bot = Bot(crewbot.TOKEN, request=CannedRequest())
+    updates = [make_update(bot, i, BUTTONS[i % len(BUTTONS)]) for i in range(n)]
+    raw_rows = [[b["text"] for b in row] for row in crewbot.KEYBOARDS["main"].to_dict()["keyboard"]]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # subs_store DB goes to a scratch dir
+        crewbot.init_subs_db()
+
+        async def via_menu(i):
+            await crewbot.menu(updates[i], None)
+
+        async def per_reply_keyboard(i):
+            kb = ReplyKeyboardMarkup(raw_rows, resize_keyboard=True)
+            await updates[i].message.reply_text("🌐 https://crewonboard.net", reply_markup=kb)
+
+        async def cached_keyboard(i):
+            await crewbot.reply(updates[i], "🌐 https://crewonboard.net")
+
+        async def dispatch_only(i):
+            crewbot.MENU_ACTIONS.get(updates[i].message.text, crewbot._fallback)
+
+        menu_us = cpu_per_call(via_menu, n)
+        fresh_us = cpu_per_call(per_reply_keyboard, n)
+        cached_us = cpu_per_call(cached_keyboard, n)
+        dispatch_us = cpu_per_call(dispatch_only, n)
+
+    print(f"{n} updates")
+    print(f"  menu() end to end:           {menu_us:8.1f} µs/update")
+    print(f"  reply, keyboard per reply:   {fresh_us:8.1f} µs/reply")
+    print(f"  reply, cached keyboard JSON: {cached_us:8.1f} µs/reply")
+    print(f"  dispatch table lookup:       {dispatch_us:8.2f} µs/update (incl. loop overhead)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# bench/polling_vs_webhook.py
+"""
+Update latency and burst throughput, polling vs webhook, against the local
+fake Bot API (no network, no real token).
+
+    python -m bench.polling_vs_webhook [--updates 200] [--chats 20] [--handler-ms 20]
+
+sequential: one update at a time, time from injection until the bot's reply
+burst:      all updates at once from --chats chats, time until every reply,
+            plus a check that replies kept per-chat order
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from bench.fake_bot_api import FakeBotAPI
+from webhook import ChatOrderedUpdateProcessor, WebhookServer
+
+TOKEN = "123456:bench"
+SECRET = "bench-secret"
+
+
+def build_app(api: FakeBotAPI, concurrency: int, handler_ms: float):
+    async def echo(update: Update, context):
+        await asyncio.sleep(handler_ms / 1000)  # stands in for DB/HTTP work
+        await update.message.reply_text(update.message.text)
+
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .base_url(api.base_url)
+        .concurrent_updates(ChatOrderedUpdateProcessor(concurrency))
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.TEXT, echo))
+    return app
+
+
+async def measure(api: FakeBotAPI, inject, updates: int, chats: int) -> dict:
+    latencies = []
+    for i in range(updates):
+        before = len(api.sent)
+        t0 = time.monotonic()
+        await inject([api.make_update(1000, f"seq:{i}")])
+        await api.wait_sent(before + 1)
+        latencies.append((api.sent[-1][2] - t0) * 1000)
+
+    before = len(api.sent)
+    batch = [api.make_update(2000 + i % chats, f"{2000 + i % chats}:{i}") for i in range(updates)]
+    t0 = time.monotonic()
+    await inject(batch)
+    await api.wait_sent(before + updates)
+    burst_s = time.monotonic() - t0
+
+    per_chat: dict[int, list[int]] = {}
+    for chat_id, text, _ in api.sent[before:]:
+        per_chat.setdefault(chat_id, []).append(int(text.split(":")[1]))
+    ordered = all(seq == sorted(seq) for seq in per_chat.values())
+
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "burst_s": burst_s,
+        "burst_per_s": updates / burst_s,
+        "ordered": ordered,
+    }
+
+
+async def run_polling(args) -> dict:
+    api = FakeBotAPI()
+    await api.start()
+    app = build_app(api, args.concurrency, args.handler_ms)
+
+    async def inject(batch):
+        for u in batch:
+            api.push_update(u)
+
+    async with app:
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+        await app.start()
+        result = await measure(api, inject, args.updates, args.chats)
+        await app.updater.stop()
+        await app.stop()
+    await api.close()
+    return result
+
+
+async def run_webhook(args) -> dict:
+    api = FakeBotAPI()
+    await api.start()
+    app = build_app(api, args.concurrency, args.handler_ms)
+    server = WebhookServer(app, "/telegram", SECRET)
+
+    async with app, httpx.AsyncClient(
+        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+        limits=httpx.Limits(max_connections=args.concurrency),
+    ) as client:
+        await server.start("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.server.sockets[0].getsockname()[1]}/telegram"
+        await app.start()
+
+        async def inject(batch):
+            # Telegram delivers webhook calls in order per chat; keep that by
+            # posting each chat's updates sequentially, chats in parallel
+            by_chat: dict[int, list[dict]] = {}
+            for u in batch:
+                by_chat.setdefault(u["message"]["chat"]["id"], []).append(u)
+
+            async def post_all(items):
+                for u in items:
+                    (await client.post(url, json=u)).raise_for_status()
+
+            await asyncio.gather(*(post_all(items) for items in by_chat.values()))
+
+        result = await measure(api, inject, args.updates, args.chats)
+        await server.close()
+        await app.stop()
+    await api.close()
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--updates", type=int, default=200)
+    p.add_argument("--chats", type=int, default=20)
+    p.add_argument("--handler-ms", type=float, default=20)
+    p.add_argument("--concurrency", type=int, default=8)
+    args = p.parse_args()
+
+    print(f"{args.updates} updates, {args.chats} chats, handler {args.handler_ms:g}ms, concurrency {args.concurrency}")
+    print(f"{'mode':<8} {'p50 ms':>8} {'p95 ms':>8} {'burst s':>8} {'upd/s':>8}  order")
+    for name, runner in (("polling", run_polling), ("webhook", run_webhook)):
+        r = asyncio.run(runner(args))
+        print(
+            f"{name:<8} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['burst_s']:>8.2f} "
+            f"{r['burst_per_s']:>8.1f}  {'ok' if r['ordered'] else 'BROKEN'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# bench/registry.py
+"""
+Memory and iteration cost of the subscriber list, tuples vs SubscriberRegistry.
+
+    python -m bench.registry [--subscribers 300000] [--vacancies 10] [--changes 1000]
+
+memory: tracemalloc of the sub_list() rows vs the registry arrays
+load:   full scan of subscriptions vs restoring the stored snapshot, and
+        the snapshot plus replaying --changes writes made since
+match:  one check_new_jobs tick of --vacancies vacancies, the old per-row
+        loop over sub_list() (fetch included) vs sub_registry() + match()
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import subs_store
+from subs_registry import SubscriberRegistry
+
+RANK_FILTERS = [
+    None, "Master", "Chief Officer", "2nd Officer", "3rd Officer",
+    "Chief Engineer", "2nd Engineer", "3rd Engineer", "4th Engineer",
+    "AB", "OS", "Fitter", "Oiler", "Cook", "ETO",
+]
+VACANCY_RANKS = ["Master", "Chief Engineer", "AB", "Cook", "Electrician (ETO)", "Bosun"]
+
+
+def populate(n: int):
+    rng = random.Random(1)
+    conn = subs_store.db()
+    conn.executemany(
+        "INSERT OR IGNORE INTO subscriptions(chat_id, rank_filter, created_at, delivery_mode) VALUES(?, ?, '', ?)",
+        (
+            (rng.randrange(10**6, 10**10), rng.choice(RANK_FILTERS), rng.choice(subs_store.DELIVERY_MODES))
+            for _ in range(n)
+        ),
+    )
+    conn.execute("INSERT INTO counters(name, value) VALUES('subscriptions', 1)")
+    conn.commit()
+
+
+def allocated(fn):
+    """(result, bytes still allocated by fn's result)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def timed(fn, runs: int = 3) -> float:
+    """best of runs, seconds"""
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def tick_tuples(vacancies: list[str]):
+    subs = subs_store.sub_list()
+    for rank in vacancies:
+        instant, queued = [], []
+        for chat_id, rank_filter, mode in subs:
+            if rank_filter:
+                if rank_filter.lower() not in rank.lower():
+                    continue
+            if mode != "instant":
+                queued.append((chat_id, mode))
+            else:
+                instant.append(chat_id)
+
+
+def tick_registry(vacancies: list[str]):
+    subs = subs_store.sub_registry()
+    for rank in vacancies:
+        subs.match(rank)
+
+
+def other_worker_writes(k: int):
+    """k rank filter changes as another worker makes them: logged, not applied to our registry."""
+    ours = subs_store._registry
+    subs_store._registry = None
+    rng = random.Random(2)
+    chat_ids = subs_store.sub_list()
+    for _ in range(k):
+        subs_store.sub_set_rank(rng.choice(chat_ids)[0], rng.choice(RANK_FILTERS))
+    subs_store._registry = ours
+
+
+def full_scan() -> SubscriberRegistry:
+    conn = subs_store.db()
+    rows = conn.execute("SELECT chat_id, rank_filter, delivery_mode FROM subscriptions ORDER BY chat_id")
+    return SubscriberRegistry.from_rows(rows, subs_store.DELIVERY_MODES, 1)
+
+
+def from_snapshot() -> SubscriberRegistry:
+    subs_store._registry = None
+    return subs_store.sub_registry()
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--subscribers", type=int, default=300_000)
+    p.add_argument("--vacancies", type=int, default=10)
+    p.add_argument("--changes", type=int, default=1000)
+    args = p.parse_args()
+    vacancies = [VACANCY_RANKS[i % len(VACANCY_RANKS)] for i in range(args.vacancies)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        subs_store.DB_PATH = os.path.join(tmp, "bench.sqlite")
+        subs_store.init_subs_db()
+        populate(args.subscribers)
+        n = len(subs_store.sub_list())  # colliding random chat_ids were skipped
+
+        rows, rows_bytes = allocated(subs_store.sub_list)
+        reg, reg_bytes = allocated(full_scan)
+        del rows
+
+        scan_s = timed(full_scan)
+        subs_store._registry = reg
+        subs_store.sub_registry_snapshot()
+        snap_s = timed(from_snapshot)
+        snap_size = len(reg.to_bytes())
+        other_worker_writes(args.changes)
+        replay_s = timed(from_snapshot)
+
+        tuples_s = timed(lambda: tick_tuples(vacancies))
+        registry_s = timed(lambda: tick_registry(vacancies))
+        put_s = timed(lambda: reg.put(5 * 10**9, "Cook", "daily") or reg.remove(5 * 10**9), runs=1000)
+
+        with sqlite3.connect(subs_store.DB_PATH) as conn:
+            db_bytes = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+    print(f"{n} subscribers, {args.vacancies} vacancies per tick (db {db_bytes / 1e6:.1f}MB)")
+    print(f"memory   sub_list() tuples: {rows_bytes / n:6.1f} B/subscriber ({rows_bytes / 1e6:.1f}MB)")
+    print(f"         registry arrays:   {reg_bytes / n:6.1f} B/subscriber ({reg_bytes / 1e6:.1f}MB)")
+    print(f"load     full scan:         {scan_s * 1000:8.1f} ms")
+    print(f"         snapshot:          {snap_s * 1000:8.1f} ms ({snap_size / 1e6:.1f}MB blob)")
+    print(f"         snapshot + replay: {replay_s * 1000:8.1f} ms ({args.changes} changes since)")
+    print(f"tick     sub_list() + loop: {tuples_s * 1000:8.1f} ms")
+    print(f"         registry match():  {registry_s * 1000:8.1f} ms")
+    print(f"write    put + remove:      {put_s * 1e6:8.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
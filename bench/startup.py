@@ -0,0 +1,118 @@
+# bench/startup.py
+"""
+Cold-start cost of the worker.
+
+    python -m bench.startup [--runs 5]
+
+import:       `python -X importtime -c "import crewbot"`, median total and
+              the heaviest top-level imports
+first update: spawn `python crewbot.py` against the local fake Bot API with
+              one update already waiting, time until its reply is sent
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.fake_bot_api import FakeBotAPI
+
+REPO = Path(__file__).resolve().parent.parent
+TOKEN = "123456:bench"
+LAZY_MODULES = ("requests", "bs4", "lxml", "reportlab")
+
+
+def bot_env(**extra) -> dict:
+    env = dict(os.environ, TOKEN=TOKEN, PYTHONPATH=str(REPO), **extra)
+    env.pop("TRACE_UPDATES", None)
+    return env
+
+
+def import_time() -> tuple[int, list[tuple[int, str]], list[str]]:
+    """(total µs, [(cumulative µs, module)] of direct imports, heavy modules loaded)"""
+    code = f"import sys, crewbot; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    with tempfile.TemporaryDirectory() as cwd:
+        p = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=cwd, env=bot_env(), capture_output=True, text=True, check=True,
+        )
+
+    total = 0
+    children = []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        if name.strip() == "crewbot":
+            total = int(cumulative)
+        elif name.startswith("   ") and not name.startswith("     "):
+            children.append((int(cumulative), name.strip()))
+    loaded = [m for m in p.stdout.strip().split(",") if m]
+    return total, sorted(children, reverse=True), loaded
+
+
+async def first_update(api: FakeBotAPI) -> float:
+    """Seconds from process spawn until the reply to a waiting update."""
+    api.sent.clear()
+    api.push_update(api.make_update(42, "🌐 Website"))
+    with tempfile.TemporaryDirectory() as cwd:
+        t0 = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, str(REPO / "crewbot.py"),
+            cwd=cwd, env=bot_env(BOT_API_URL=api.base_url),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            await api.wait_sent(1, timeout=60)
+            elapsed = api.sent[0][2] - t0
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(proc.wait(), 15)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+    return elapsed
+
+
+async def first_update_runs(runs: int) -> list[float]:
+    api = FakeBotAPI()
+    await api.start()
+    try:
+        return [await first_update(api) for _ in range(runs)]
+    finally:
+        await api.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--runs", type=int, default=5)
+    args = p.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        total, children, loaded = import_time()
+        totals.append(total)
+    print(f"import crewbot: median {statistics.median(totals) / 1000:.1f}ms over {args.runs} runs")
+    for cumulative, name in children[:8]:
+        print(f"  {cumulative / 1000:>7.1f}ms  {name}")
+    print(f"  lazy modules loaded at import: {', '.join(loaded) or 'none'}")
+
+    times = asyncio.run(first_update_runs(args.runs))
+    print(
+        f"time to first handled update: median {statistics.median(times) * 1000:.0f}ms "
+        f"(min {min(times) * 1000:.0f}ms, max {max(times) * 1000:.0f}ms)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,63 @@
+import csv
+import hashlib
+import json
+import logging
 import os
-import re
-import sqlite3
+import signal
+import socket
+import time
 from datetime import datetime, timezone
-
-from pdf_gen import generate_profile_pdf
+from io import BytesIO, StringIO
 
 from profile_store import get_profile, upsert_profile
 
 from profile_wizard import profile_menu, build_profile_wizard
 
+from admin import admin_chat_id, require_admin
+from profiling import TRACE_UPDATES, cmd_sample, traced
+
 from telegram.ext import CallbackQueryHandler
 
 
 from db import init_db
 
-import requests
-from bs4 import BeautifulSoup
+from subs_store import (
+    chat_state_get,
+    chat_state_set,
+    digest_commit,
+    digest_last_flush,
+    digest_mark_flushed,
+    init_subs_db,
+    digest_pending,
+    lease_acquire,
+    lease_held,
+    lease_release,
+    outbox_claim,
+    outbox_extend_claim,
+    outbox_mark_failed,
+    outbox_mark_sent,
+    outbox_prune,
+    outbox_release,
+    publish_vacancy,
+    seen_filter_new,
+    stats_snapshot,
+    sub_add,
+    sub_get,
+    sub_registry,
+    sub_registry_snapshot,
+    sub_remove,
+    sub_set_mode,
+    sub_set_rank,
+)
+
+import asyncio
+
+from sources import SOURCES, enabled_sources, poll_sources, prewarm
+
+from webhook import ChatOrderedUpdateProcessor, run_webhook
+
 from telegram import Update, ReplyKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, InvalidToken, NetworkError, RetryAfter, TelegramError
 from telegram.ext  import (
     ApplicationBuilder,
     CommandHandler,
@@ -29,428 +70,603 @@ TOKEN = os.getenv("TOKEN", "").strip()
 if not TOKEN or ":" not in TOKEN:
     raise RuntimeError("TOKEN is missing/invalid. Set Railway Variable TOKEN from @BotFather.")
 
-BASE_URL = "https://crewonboard.net/"
-DB_PATH = "crewbot.sqlite"
 CHECK_EVERY_SECONDS = 600  # 10 minutes
+DIGEST_WINDOWS = {"hourly": 3600, "daily": 86400}
+DIGEST_CHECK_SECONDS = 60
+DIGEST_FLUSH_CHATS = 500  # subscribers loaded per flush chunk
+OUTBOX_DRAIN_SECONDS = 30
+OUTBOX_BATCH = 100
+OUTBOX_CLAIM_SECONDS = 120
+OUTBOX_PRUNE_SECONDS = 3600
+# after a network-level failure, pause draining; doubles per failure up to the max
+OUTBOX_BACKOFF_MIN_SECONDS = 5
+OUTBOX_BACKOFF_MAX_SECONDS = 300
+SUBS_SNAPSHOT_SECONDS = 300
+
+# Scale-out, same host only: workers coordinate through crewbot.sqlite, so
+# they must share its disk (e.g. two processes in one container under a
+# supervisor; separate Railway/Heroku process types each get their own
+# ephemeral disk and DB). Every worker drains the outbox; only the holder
+# of the "scheduler" lease scrapes and flushes digests. WORKER_POLLING=0
+# runs a worker that receives no updates at all (neither getUpdates nor webhook).
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+WORKER_POLLING = os.getenv("WORKER_POLLING", "1").strip() not in ("0", "false", "no")
+SCHEDULER_LEASE = "scheduler"
+LEASE_TTL_SECONDS = 60
+UPDATES_LEASE = "updates"
+
+# Update intake: BOT_MODE=polling (default) or webhook. Exactly one process
+# receives updates: per-chat ordering, the profile wizard's ConversationHandler
+# state and user_data all live in that process. Telegram enforces this for
+# polling; in webhook mode the process must hold the "updates" lease.
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "8"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+WEBHOOK_PATH = "/telegram"
+# same on every worker without extra config; Telegram allows [A-Za-z0-9_-]
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TOKEN.encode()).hexdigest()[:32]
+# e.g. a self-hosted Bot API server: http://localhost:8081/bot
+BOT_API_URL = os.getenv("BOT_API_URL", "").strip()
+
+# reportlab and the scraping stack load lazily; PREWARM imports them in a
+# background thread shortly after the bot starts taking updates
+PREWARM = os.getenv("PREWARM", "1").strip() not in ("0", "false", "no")
+PREWARM_AFTER_SECONDS = 5
+MAX_MESSAGE_LEN = 4096  # Telegram limit per message
+
+
+# ---------------- MESSAGES ----------------
+VACANCY_TEMPLATE = (
+    "🆕 NEW VACANCY\n\n"
+    "⚓ Rank: {rank}\n"
+    "🚢 Vessel: {vessel}\n"
+    "💰 Salary: {salary}\n"
+    "📄 Contract: {contract}\n\n"
+    "🔗 {url}"
+)
 
-VAC_RE = re.compile(r"/vacancy/detail/(\d+)", re.IGNORECASE)
-
-
-# ---------------- DB ----------------
-def db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            chat_id INTEGER PRIMARY KEY,
-            rank_filter TEXT DEFAULT NULL,
-            created_at TEXT NOT NULL
-        )
-        """
-    )
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS seen_vacancies (
-            vacancy_id INTEGER PRIMARY KEY,
-            first_seen_at TEXT NOT NULL
-        )
-        """
-    )
-    conn.commit()
-    return conn
+DIGEST_ENTRY_TEMPLATE = (
+    "⚓ {rank} • 🚢 {vessel}\n"
+    "💰 {salary} • 📄 {contract}\n"
+    "🔗 {url}"
+)
 
 
-def sub_add(chat_id: int):
-    conn = db()
-    conn.execute(
-        "INSERT OR IGNORE INTO subscriptions(chat_id, rank_filter, created_at) VALUES(?, NULL, ?)",
-        (chat_id, datetime.now(timezone.utc).isoformat()),
-    )
-    conn.commit()
-    conn.close()
+def format_vacancy_message(d: dict[str, str]) -> str:
+    return VACANCY_TEMPLATE.format_map(d)
 
 
-def sub_remove(chat_id: int):
-    conn = db()
-    conn.execute("DELETE FROM subscriptions WHERE chat_id=?", (chat_id,))
-    conn.commit()
-    conn.close()
+def format_digest_entry(d: dict[str, str]) -> str:
+    return DIGEST_ENTRY_TEMPLATE.format_map(d)
 
 
-def sub_set_rank(chat_id: int, rank: str | None):
-    conn = db()
-    conn.execute(
-        "INSERT OR IGNORE INTO subscriptions(chat_id, rank_filter, created_at) VALUES(?, NULL, ?)",
-        (chat_id, datetime.now(timezone.utc).isoformat()),
-    )
-    conn.execute("UPDATE subscriptions SET rank_filter=? WHERE chat_id=?", (rank, chat_id))
-    conn.commit()
-    conn.close()
+def format_digest_messages(mode: str, entries: list[str]) -> list[str]:
+    """Joins digest entries into as few messages as the Telegram length limit allows."""
+    header = f"📬 {mode.capitalize()} digest: {len(entries)} new vacanc{'y' if len(entries) == 1 else 'ies'}\n\n"
+    messages = []
+    cur = header
+    for entry in entries:
+        if len(cur) + len(entry) + 2 > MAX_MESSAGE_LEN and cur != header:
+            messages.append(cur.rstrip())
+            cur = ""
+        cur += entry + "\n\n"
+    if cur.strip():
+        messages.append(cur.rstrip())
+    return messages
+
+
+# ---------------- BOT UI ----------------
+RANKS = [
+    "Any", "Master", "Chief Officer", "2nd Officer", "3rd Officer",
+    "Chief Engineer", "2nd Engineer", "3rd Engineer", "4th Engineer",
+    "AB", "OS", "Fitter", "Oiler", "Cook", "ETO"
+]
+RANK_SET = frozenset(RANKS)
+
+MODE_BUTTONS = {
+    "⚡ Instant": "instant",
+    "🕐 Hourly digest": "hourly",
+    "📅 Daily digest": "daily",
+}
 
 
-def sub_list():
-    conn = db()
-    rows = conn.execute("SELECT chat_id, rank_filter FROM subscriptions").fetchall()
-    conn.close()
+def _rank_rows() -> list[list[str]]:
+    rows = [RANKS[i:i + 3] for i in range(0, len(RANKS), 3)]
+    rows.append(["⬅️ Back"])
     return rows
 
 
-def seen_add(vacancy_id: int) -> bool:
-    """True if new, False if already seen."""
-    conn = db()
-    cur = conn.execute("SELECT 1 FROM seen_vacancies WHERE vacancy_id=?", (vacancy_id,))
-    exists = cur.fetchone() is not None
-    if not exists:
-        conn.execute(
-            "INSERT INTO seen_vacancies(vacancy_id, first_seen_at) VALUES(?, ?)",
-            (vacancy_id, datetime.now(timezone.utc).isoformat()),
-        )
-        conn.commit()
-    conn.close()
-    return not exists
-
-
-# ---------------- SCRAPE (Homepage IDs) ----------------
-def fetch_latest_vacancy_ids(limit: int = 30) -> list[int]:
-    """Strictly loads BASE_URL and extracts vacancy IDs from links like /vacancy/detail/12345"""
-    r = requests.get(
-        BASE_URL,
-        timeout=25,
-        headers={"User-Agent": "crewbot/1.0 (Telegram bot)"},
-    )
-    r.raise_for_status()
+# Keyboards are built once (TelegramObjects are frozen after __init__) and
+# their reply_markup JSON is serialized once too; reply() sends the cached
+# string instead of re-serializing the markup on every message.
+KEYBOARDS = {
+    "main": ReplyKeyboardMarkup(
+        [
+            ["⚓ Latest Jobs", "🌐 Website"],
+            ["🔔 Subscribe", "🔕 Unsubscribe"],
+            ["🎯 Set Rank Filter", "❌ Clear Filter"],
+            ["📬 Delivery Mode", "📄 Apply Online"],
+            ["📧 Contact", "ℹ️ About CrewOnBoard"],
+        ],
+        resize_keyboard=True,
+    ),
+    "rank": ReplyKeyboardMarkup(_rank_rows(), resize_keyboard=True),
+    "mode": ReplyKeyboardMarkup([list(MODE_BUTTONS), ["⬅️ Back"]], resize_keyboard=True),
+}
+KEYBOARD_JSON = {name: json.dumps(kb.to_dict()) for name, kb in KEYBOARDS.items()}
 
-    soup = BeautifulSoup(r.text, "lxml")
-    ids: list[int] = []
 
-    for a in soup.select("a[href]"):
-        href = a.get("href") or ""
-        m = VAC_RE.search(href)
-        if m:
-            ids.append(int(m.group(1)))
+async def reply(update: Update, text: str, keyboard: str = "main"):
+    await update.message.reply_text(text, api_kwargs={"reply_markup": KEYBOARD_JSON[keyboard]})
 
-    # unique keep order
-    seen = set()
-    uniq = []
-    for vid in ids:
-        if vid not in seen:
-            seen.add(vid)
-            uniq.append(vid)
 
-    return uniq[:limit]
+WELCOME_TEXT = (
+    "⚓ Welcome to CrewOnBoard\n\n"
+    "Global Maritime Job Platform 🌍\n\n"
+    "Press 🔔 Subscribe to receive new vacancies.\n"
+    "Press ⚓ Latest Jobs to see recent links from homepage."
+)
 
 
-def vacancy_link(vacancy_id: int) -> str:
-    return f"{BASE_URL}vacancy/detail/{vacancy_id}"
+@traced
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply(update, WELCOME_TEXT)
 
 
-# ---------------- SCRAPE (Vacancy details) ----------------
-def _clean(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "")).strip()
+@traced
+async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    row = sub_get(chat_id)
 
+    if row is None:
+        await reply(update, "Status: not subscribed.")
+    else:
+        rf = row[0] or "Any"
+        await reply(update, f"Status: subscribed ✅\nRank filter: {rf}\nDelivery: {row[1]}")
 
-def _norm_key(s: str) -> str:
-    s = _clean(s).lower()
-    s = s.replace(":", "")
-    return s
 
+ANALYTICS_TOP_RANKS = 15
 
-def parse_detail_pairs(soup: BeautifulSoup) -> dict[str, str]:
-    """
-    Tries to extract key/value pairs from common HTML patterns:
-    - table rows (th/td)
-    - dt/dd definition lists
-    """
-    pairs: dict[str, str] = {}
-
-    # tables
-    for tr in soup.select("tr"):
-        th = tr.find("th")
-        td = tr.find("td")
-        if th and td:
-            k = _norm_key(th.get_text(" ", strip=True))
-            v = _clean(td.get_text(" ", strip=True))
-            if k and v:
-                pairs[k] = v
-
-    # dt/dd
-    for dl in soup.select("dl"):
-        dts = dl.find_all("dt")
-        for dt in dts:
-            dd = dt.find_next_sibling("dd")
-            if dd:
-                k = _norm_key(dt.get_text(" ", strip=True))
-                v = _clean(dd.get_text(" ", strip=True))
-                if k and v:
-                    pairs[k] = v
-
-    return pairs
-
-
-def guess_details_from_text(text: str) -> dict[str, str]:
-    """
-    Fallback: regex search in full page text.
-    """
-    out: dict[str, str] = {}
-    t = _clean(text)
 
-    # Common labels
-    patterns = {
-        "rank": [
-            r"(rank|position)\s*[:\-]\s*([A-Za-z0-9/ &\.\-]+)",
-        ],
-        "vessel": [
-            r"(vessel|vessel type|ship type)\s*[:\-]\s*([A-Za-z0-9/ &\.\-]+)",
-        ],
-        "salary": [
-            r"(salary|wage)\s*[:\-]\s*([A-Za-z0-9/ €$£\.\-,]+)",
-        ],
-        "contract": [
-            r"(contract|contract duration)\s*[:\-]\s*([A-Za-z0-9/ &\.\-]+)",
-        ],
-    }
+def format_analytics(rows: list[tuple[str, str, int]]) -> str:
+    stats: dict[str, list[tuple[str, int]]] = {}
+    for metric, key, value in rows:
+        stats.setdefault(metric, []).append((key, value))
 
-    for field, pats in patterns.items():
-        for p in pats:
-            m = re.search(p, t, flags=re.IGNORECASE)
-            if m:
-                out[field] = _clean(m.group(2))
-                break
+    def section(title: str, metric: str, limit: int | None = None) -> list[str]:
+        items = stats.get(metric, [])
+        lines = [f"\n{title}:"]
+        lines += [f"  {key}: {value}" for key, value in items[:limit]] or ["  —"]
+        return lines
 
-    return out
+    total = sum(v for _, v in stats.get("subscribers_by_rank", []))
+    lines = [f"📊 Subscribers: {total}"]
+    lines += section("By rank filter", "subscribers_by_rank")
+    lines += section("By delivery", "subscribers_by_mode")
+    lines += section("Notifications", "notifications")
+    lines += section("Vacancies", "vacancies")
+    lines += section(f"Top {ANALYTICS_TOP_RANKS} vacancy ranks", "vacancies_by_rank", ANALYTICS_TOP_RANKS)
+    return "\n".join(lines)
 
 
-def fetch_vacancy_details(vacancy_id: int) -> dict[str, str]:
+@traced
+async def cmd_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Loads vacancy detail page and tries to extract Rank/Vessel/Salary/Contract.
+    /analytics [csv] — admin only. Reads the aggregates subs_store keeps
+    up to date on every write, so it costs the same with any number of
+    subscribers.
     """
-    url = vacancy_link(vacancy_id)
-    r = requests.get(url, timeout=25, headers={"User-Agent": "crewbot/1.0 (Telegram bot)"})
-    r.raise_for_status()
-
-    soup = BeautifulSoup(r.text, "lxml")
-
-    # 1) extract pairs from tables/dl
-    pairs = parse_detail_pairs(soup)
-
-    # map keys to our fields (different sites use different labels)
-    def pick(*keys: str) -> str | None:
-        for k in keys:
-            nk = _norm_key(k)
-            for kk, vv in pairs.items():
-                if kk == nk:
-                    return vv
-        return None
-
-    rank = pick("Rank", "Position", "Post", "Vacancy", "Job title")
-    vessel = pick("Vessel", "Vessel type", "Ship type", "Type of vessel")
-    salary = pick("Salary", "Wage", "Salary per month", "Monthly salary")
-    contract = pick("Contract", "Contract duration", "Duration", "Period")
-
-    # 2) fallback from full text if something missing
-    text = soup.get_text(" ", strip=True)
-    guessed = guess_details_from_text(text)
-
-    rank = rank or guessed.get("rank")
-    vessel = vessel or guessed.get("vessel")
-    salary = salary or guessed.get("salary")
-    contract = contract or guessed.get("contract")
-
-    # final cleanup / defaults
-    rank = rank or "Unknown"
-    vessel = vessel or "Unknown"
-    salary = salary or "Negotiable"
-    contract = contract or "Unknown"
-
-    return {
-        "rank": _clean(rank),
-        "vessel": _clean(vessel),
-        "salary": _clean(salary),
-        "contract": _clean(contract),
-        "url": url,
-    }
+    if not await require_admin(update):
+        return
 
+    rows = stats_snapshot()
+    if not context.args:
+        await update.message.reply_text(format_analytics(rows))
+        return
+    if context.args[0].lower() != "csv":
+        await update.message.reply_text("Usage: /analytics [csv]")
+        return
 
-def format_vacancy_message(d: dict[str, str]) -> str:
-    return (
-        "🆕 NEW VACANCY\n\n"
-        f"⚓ Rank: {d['rank']}\n"
-        f"🚢 Vessel: {d['vessel']}\n"
-        f"💰 Salary: {d['salary']}\n"
-        f"📄 Contract: {d['contract']}\n\n"
-        f"🔗 {d['url']}"
-    )
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["metric", "key", "value"])
+    writer.writerows(rows)
+    filename = f"crewbot_analytics_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.csv"
+    await update.message.reply_document(document=BytesIO(out.getvalue().encode("utf-8")), filename=filename)
 
 
-# ---------------- BOT UI ----------------
-RANKS = [
-    "Any", "Master", "Chief Officer", "2nd Officer", "3rd Officer",
-    "Chief Engineer", "2nd Engineer", "3rd Engineer", "4th Engineer",
-    "AB", "OS", "Fitter", "Oiler", "Cook", "ETO"
-]
+# ---------------- MENU ACTIONS ----------------
+async def _choose_rank(update: Update, chat_id: int, message: str):
+    if message == "⬅️ Back":
+        chat_state_set(chat_id, None)
+        await reply(update, "Back to menu.")
+        return
+
+    if message not in RANK_SET:
+        await reply(update, "Choose rank using buttons.", "rank")
+        return
 
+    chat_state_set(chat_id, None)
+    sub_set_rank(chat_id, None if message == "Any" else message)
+    await reply(update, f"✅ Rank filter set to: {message}")
 
-def main_menu():
-    keyboard = [
-        ["⚓ Latest Jobs", "🌐 Website"],
-        ["🔔 Subscribe", "🔕 Unsubscribe"],
-        ["🎯 Set Rank Filter", "❌ Clear Filter"],
-        ["📄 Apply Online", "📧 Contact"],
-        ["ℹ️ About CrewOnBoard"]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-
-def rank_menu():
-    rows = []
-    row = []
-    for i, r in enumerate(RANKS, 1):
-        row.append(r)
-        if i % 3 == 0:
-            rows.append(row)
-            row = []
-    if row:
-        rows.append(row)
-    rows.append(["⬅️ Back"])
-    return ReplyKeyboardMarkup(rows, resize_keyboard=True)
 
+async def _choose_mode(update: Update, chat_id: int, message: str):
+    if message == "⬅️ Back":
+        chat_state_set(chat_id, None)
+        await reply(update, "Back to menu.")
+        return
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (
-        "⚓ Welcome to CrewOnBoard\n\n"
-        "Global Maritime Job Platform 🌍\n\n"
-        "Press 🔔 Subscribe to receive new vacancies.\n"
-        "Press ⚓ Latest Jobs to see recent links from homepage."
+    if message not in MODE_BUTTONS:
+        await reply(update, "Choose delivery mode using buttons.", "mode")
+        return
+
+    chat_state_set(chat_id, None)
+    sub_set_mode(chat_id, MODE_BUTTONS[message])
+    await reply(update, f"✅ Delivery mode set to: {message}")
+
+
+async def _latest_jobs(update: Update, chat_id: int):
+    try:
+        homepage = SOURCES["crewonboard"]
+        ids = await asyncio.to_thread(homepage.list_ids, 10)
+        if not ids:
+            await reply(update, "No jobs found on homepage right now.")
+            return
+
+        lines = ["⚓ Latest Jobs (from homepage):\n"]
+        for vid in ids:
+            lines.append(homepage.vacancy_link(vid))
+        await reply(update, "\n".join(lines))
+    except Exception as e:
+        await reply(update, f"Error loading jobs: {e}")
+
+
+async def _subscribe(update: Update, chat_id: int):
+    sub_add(chat_id)
+    await reply(update, "✅ Subscribed! I will send new jobs (with details).")
+
+
+async def _unsubscribe(update: Update, chat_id: int):
+    sub_remove(chat_id)
+    await reply(update, "✅ Unsubscribed.")
+
+
+async def _set_rank_filter(update: Update, chat_id: int):
+    sub_add(chat_id)
+    chat_state_set(chat_id, "awaiting_rank")
+    await reply(update, "Choose rank filter:", "rank")
+
+
+async def _clear_filter(update: Update, chat_id: int):
+    sub_set_rank(chat_id, None)
+    await reply(update, "✅ Filter cleared (Any).")
+
+
+async def _delivery_mode(update: Update, chat_id: int):
+    sub_add(chat_id)
+    chat_state_set(chat_id, "awaiting_mode")
+    await reply(
+        update,
+        "Choose how to receive vacancies:\n"
+        "⚡ Instant — one message per vacancy\n"
+        "🕐 Hourly / 📅 Daily — one combined digest per window",
+        "mode",
     )
-    await update.message.reply_text(text, reply_markup=main_menu())
 
 
-async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
-    conn = db()
-    row = conn.execute("SELECT rank_filter FROM subscriptions WHERE chat_id=?", (chat_id,)).fetchone()
-    conn.close()
+def _static(text: str):
+    async def action(update: Update, chat_id: int):
+        await reply(update, text)
+    return action
 
-    if row is None:
-        await update.message.reply_text("Status: not subscribed.", reply_markup=main_menu())
-    else:
-        rf = row[0] or "Any"
-        await update.message.reply_text(f"Status: subscribed ✅\nRank filter: {rf}", reply_markup=main_menu())
 
+# button text -> action, built once at import
+MENU_ACTIONS = {
+    "⚓ Latest Jobs": _latest_jobs,
+    "🌐 Website": _static("🌐 https://crewonboard.net"),
+    "📄 Apply Online": _static("📄 Apply here:\n\nhttps://crewonboard.net"),
+    "📧 Contact": _static("📧 crew@crewonboard.net"),
+    "ℹ️ About CrewOnBoard": _static("CrewOnBoard is a global maritime job platform."),
+    "🔔 Subscribe": _subscribe,
+    "🔕 Unsubscribe": _unsubscribe,
+    "🎯 Set Rank Filter": _set_rank_filter,
+    "❌ Clear Filter": _clear_filter,
+    "📬 Delivery Mode": _delivery_mode,
+}
+
+# chat_state value -> handler for the next message
+STATE_ACTIONS = {
+    "awaiting_rank": _choose_rank,
+    "awaiting_mode": _choose_mode,
+}
 
+_fallback = _static("Choose an option from the menu 👇")
+
+
+@traced
 async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = (update.message.text or "").strip()
     chat_id = update.effective_chat.id
 
-    # rank selection flow
-    if context.user_data.get("awaiting_rank"):
-        if message == "⬅️ Back":
-            context.user_data["awaiting_rank"] = False
-            await update.message.reply_text("Back to menu.", reply_markup=main_menu())
-            return
+    # menu state lives in the shared DB so any worker can handle the next message
+    state_action = STATE_ACTIONS.get(chat_state_get(chat_id))
+    if state_action is not None:
+        await state_action(update, chat_id, message)
+        return
+
+    await MENU_ACTIONS.get(message, _fallback)(update, chat_id)
 
-        if message not in RANKS:
-            await update.message.reply_text("Choose rank using buttons.", reply_markup=rank_menu())
+
+# ---------------- BACKGROUND CHECK ----------------
+@traced
+async def check_new_jobs(context: ContextTypes.DEFAULT_TYPE):
+    if not await asyncio.to_thread(lease_held, SCHEDULER_LEASE, WORKER_ID):
+        return
+    try:
+        # All sources are polled concurrently; each returns up to 10 new
+        # vacancies with details. A vacancy whose details fail to load
+        # stays unseen and is retried on the next tick.
+        vacancies = await poll_sources(enabled_sources(), seen_filter_new, list_limit=30, max_new=10)
+        if not vacancies:
             return
 
-        context.user_data["awaiting_rank"] = False
-        if message == "Any":
-            sub_set_rank(chat_id, None)
-            await update.message.reply_text("✅ Rank filter set to: Any", reply_markup=main_menu())
-        else:
-            sub_set_rank(chat_id, message)
-            await update.message.reply_text(f"✅ Rank filter set to: {message}", reply_markup=main_menu())
+        subs = sub_registry()
+
+        # Mark each vacancy seen and enqueue all its deliveries atomically
+        for details in vacancies:
+            msg = format_vacancy_message(details)
+            entry = format_digest_entry(details)
+
+            # rank filter (simple contains match), grouped by delivery mode
+            matched = subs.match(details["rank"])
+            queued = [(chat_id, mode) for mode in DIGEST_WINDOWS for chat_id in matched[mode]]
+            publish_vacancy(details, msg, matched["instant"], queued, entry)
+
+        # sent by a separate job: a long backlog must not hold up the next tick
+        context.job_queue.run_once(drain_outbox_job, 0)
+    except Exception:
         return
 
-    if message == "⚓ Latest Jobs":
-        try:
-            ids = fetch_latest_vacancy_ids(limit=10)
-            if not ids:
-                await update.message.reply_text("No jobs found on homepage right now.", reply_markup=main_menu())
-                return
 
-            lines = ["⚓ Latest Jobs (from homepage):\n"]
-            for vid in ids:
-                lines.append(vacancy_link(vid))
-            await update.message.reply_text("\n".join(lines), reply_markup=main_menu())
-        except Exception as e:
-            await update.message.reply_text(f"Error loading jobs: {e}", reply_markup=main_menu())
+@traced
+async def flush_digests(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Moves one combined message per subscriber into the outbox for every
+    digest mode whose window has passed since its last flush. Flush times
+    live in the DB, so restarts and leader changes don't reset the windows.
+    """
+    if not await asyncio.to_thread(lease_held, SCHEDULER_LEASE, WORKER_ID):
+        return
+    now = time.time()
+    try:
+        for mode, window in DIGEST_WINDOWS.items():
+            last = digest_last_flush(mode)
+            if last is None:
+                digest_mark_flushed(mode, now)  # first window starts now
+                continue
+            if now - last < window:
+                continue
+
+            after = None
+            while True:
+                pending = digest_pending(mode, after, DIGEST_FLUSH_CHATS)
+                if not pending:
+                    break
+                for chat_id, items in pending.items():
+                    messages = format_digest_messages(mode, [text for _, text in items])
+                    digest_commit(chat_id, mode, items[-1][0], messages)
+                    after = chat_id
+            # only after a complete flush; a failed one is retried next check
+            digest_mark_flushed(mode, now)
+
+        context.job_queue.run_once(drain_outbox_job, 0)
+    except Exception:
+        return
 
-    elif message == "🌐 Website":
-        await update.message.reply_text("🌐 https://crewonboard.net", reply_markup=main_menu())
 
-    elif message == "📄 Apply Online":
-        await update.message.reply_text("📄 Apply here:\n\nhttps://crewonboard.net", reply_markup=main_menu())
+@traced
+async def snapshot_subscribers(context: ContextTypes.DEFAULT_TYPE):
+    """Saves the scheduler's subscriber registry so a restarted leader replays only recent changes."""
+    if not await asyncio.to_thread(lease_held, SCHEDULER_LEASE, WORKER_ID):
+        return
+    try:
+        sub_registry_snapshot()
+    except Exception:
+        return
 
-    elif message == "📧 Contact":
-        await update.message.reply_text("📧 crew@crewonboard.net", reply_markup=main_menu())
 
-    elif message == "ℹ️ About CrewOnBoard":
-        await update.message.reply_text("CrewOnBoard is a global maritime job platform.", reply_markup=main_menu())
+# ---------------- OUTBOX SENDER ----------------
+_drain_lock = asyncio.Lock()
+_backoff_until = 0.0
+_backoff_seconds = 0.0
 
-    elif message == "🔔 Subscribe":
-        sub_add(chat_id)
-        await update.message.reply_text("✅ Subscribed! I will send new jobs (with details).", reply_markup=main_menu())
 
-    elif message == "🔕 Unsubscribe":
-        sub_remove(chat_id)
-        await update.message.reply_text("✅ Unsubscribed.", reply_markup=main_menu())
+def _back_off():
+    global _backoff_until, _backoff_seconds
+    _backoff_seconds = min(max(_backoff_seconds * 2, OUTBOX_BACKOFF_MIN_SECONDS), OUTBOX_BACKOFF_MAX_SECONDS)
+    _backoff_until = time.monotonic() + _backoff_seconds
 
-    elif message == "🎯 Set Rank Filter":
-        sub_add(chat_id)
-        context.user_data["awaiting_rank"] = True
-        await update.message.reply_text("Choose rank filter:", reply_markup=rank_menu())
 
-    elif message == "❌ Clear Filter":
-        sub_set_rank(chat_id, None)
-        await update.message.reply_text("✅ Filter cleared (Any).", reply_markup=main_menu())
+async def drain_outbox(bot) -> int:
+    """
+    Sends outbox messages claimed by this worker, oldest first
+    (at-least-once: a crash between send and mark re-sends that one
+    message once the claim expires). A message that failed transiently
+    keeps its claim, so it is retried after OUTBOX_CLAIM_SECONDS.
+    If Telegram is unreachable, the rest of the batch is released without
+    counting attempts and draining pauses with exponential backoff.
+    Returns how many were sent.
+    """
+    global _backoff_seconds
+    if _drain_lock.locked() or time.monotonic() < _backoff_until:
+        return 0
+
+    sent = 0
+    async with _drain_lock:
+        while True:
+            batch = await asyncio.to_thread(outbox_claim, WORKER_ID, OUTBOX_BATCH, OUTBOX_CLAIM_SECONDS)
+            if not batch:
+                break
+            claimed_at = time.monotonic()
+            mine = None
+            for n, (outbox_id, chat_id, text) in enumerate(batch):
+                if time.monotonic() - claimed_at > OUTBOX_CLAIM_SECONDS / 2:
+                    # slow sends: keep the rest of the batch ours so nobody re-sends it
+                    mine = await asyncio.to_thread(
+                        outbox_extend_claim, WORKER_ID, [row[0] for row in batch[n:]], OUTBOX_CLAIM_SECONDS
+                    )
+                    claimed_at = time.monotonic()
+                if mine is not None and outbox_id not in mine:
+                    continue
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text)
+                except RetryAfter as e:
+                    # flood control: leave the rest for a later drain
+                    await asyncio.to_thread(outbox_release, WORKER_ID, [row[0] for row in batch[n:]])
+                    await asyncio.sleep(e.retry_after)
+                    return sent
+                except Forbidden:
+                    # blocked the bot / removed it from the chat: stop queueing for it
+                    await asyncio.to_thread(outbox_mark_failed, outbox_id, permanent=True)
+                    sub_remove(chat_id)  # on the loop: it updates the registry
+                    continue
+                except BadRequest:
+                    # chat gone / message rejected: retrying won't help
+                    await asyncio.to_thread(outbox_mark_failed, outbox_id, permanent=True)
+                    continue
+                except (NetworkError, InvalidToken):
+                    # Telegram unreachable (BadRequest is handled above):
+                    # not this message's fault, don't spend its attempts
+                    await asyncio.to_thread(outbox_release, WORKER_ID, [row[0] for row in batch[n:]])
+                    _back_off()
+                    return sent
+                except TelegramError:
+                    await asyncio.to_thread(outbox_mark_failed, outbox_id)
+                    continue
+                await asyncio.to_thread(outbox_mark_sent, outbox_id)
+                _backoff_seconds = 0.0
+                sent += 1
+            if len(batch) < OUTBOX_BATCH:
+                break
+    return sent
 
-    else:
-        await update.message.reply_text("Choose an option from the menu 👇", reply_markup=main_menu())
 
+@traced
+async def drain_outbox_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await drain_outbox(context.bot)
+    except Exception:
+        return
 
-# ---------------- BACKGROUND CHECK ----------------
-async def check_new_jobs(context: ContextTypes.DEFAULT_TYPE):
+
+@traced
+async def prune_outbox_job(context: ContextTypes.DEFAULT_TYPE):
     try:
-        ids = fetch_latest_vacancy_ids(limit=30)
-        if not ids:
-            return
+        await asyncio.to_thread(outbox_prune)
+    except Exception:
+        return
 
-        new_ids = []
-        for vid in ids:
-            if seen_add(vid):
-                new_ids.append(vid)
 
-        if not new_ids:
-            return
+# ---------------- LEADER LEASE ----------------
+def _receives_webhook() -> bool:
+    return BOT_MODE == "webhook" and WORKER_POLLING
 
-        subs = sub_list()
 
-        # For each new vacancy, load details once, then send to all subs
-        for vid in new_ids[:10]:
-            details = fetch_vacancy_details(vid)
-            msg = format_vacancy_message(details)
+async def lease_heartbeat(context: ContextTypes.DEFAULT_TYPE):
+    """Takes the scheduler lease if free, renews it if ours; renews the updates lease."""
+    try:
+        await asyncio.to_thread(lease_acquire, SCHEDULER_LEASE, WORKER_ID, LEASE_TTL_SECONDS)
+        if _receives_webhook():
+            if not await asyncio.to_thread(lease_acquire, UPDATES_LEASE, WORKER_ID, LEASE_TTL_SECONDS):
+                # another process took over update intake (we were stalled past
+                # the TTL): stop taking updates; a restart waits for the lease
+                signal.raise_signal(signal.SIGTERM)
+    except Exception:
+        return
+
+
+def wait_for_updates_lease():
+    """Blocks until this process may receive webhook updates, e.g. the previous deploy has stopped."""
+    while not lease_acquire(UPDATES_LEASE, WORKER_ID, LEASE_TTL_SECONDS):
+        time.sleep(LEASE_TTL_SECONDS / 3)
 
-            for chat_id, rank_filter in subs:
-                # rank filter (simple contains match)
-                if rank_filter:
-                    if rank_filter.lower() not in details["rank"].lower():
-                        continue
-                await context.bot.send_message(chat_id=chat_id, text=msg)
 
+async def release_lease(application):
+    # the next scheduler starts from this registry instead of replaying since the last snapshot
+    try:
+        sub_registry_snapshot()
+    except Exception:
+        pass
+    # lets another worker take over right away instead of after the TTL
+    await asyncio.to_thread(lease_release, SCHEDULER_LEASE, WORKER_ID)
+    await asyncio.to_thread(lease_release, UPDATES_LEASE, WORKER_ID)
+
+
+async def run_without_polling(application):
+    """Job queue only (outbox sender / standby scheduler) until SIGTERM/SIGINT."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await stop.wait()
+        await application.stop()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+# ---------------- STARTUP ----------------
+def _prewarm_imports():
+    import pdf_gen  # noqa: F401
+
+    prewarm()
+
+
+async def prewarm_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await asyncio.to_thread(_prewarm_imports)
     except Exception:
         return
 
 
 # ---------------- RUN ----------------
 def main():
-    application = ApplicationBuilder().token(TOKEN).build()
+    if TRACE_UPDATES:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    enabled_sources()  # fail fast on a bad VACANCY_SOURCES
+    if BOT_MODE not in ("polling", "webhook"):
+        raise RuntimeError(f"Unknown BOT_MODE: {BOT_MODE}")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise RuntimeError("BOT_MODE=webhook needs WEBHOOK_URL (public https base URL).")
+
+    # schema work before anything can receive an update
+    init_db()
+    init_subs_db()
+
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .post_shutdown(release_lease)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("status", cmd_status))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, menu))
     application.add_handler(CommandHandler("testadmin", test_admin))
+    application.add_handler(CommandHandler("sample", cmd_sample))
+    application.add_handler(CommandHandler("analytics", cmd_analytics))
 
     application.add_handler(CommandHandler("pdf", pdf_command))
     application.add_handler(CommandHandler("profile", profile_menu))
@@ -464,34 +680,49 @@ def main():
         interval=CHECK_EVERY_SECONDS,
         first=10
     )
+    application.job_queue.run_repeating(flush_digests, interval=DIGEST_CHECK_SECONDS, first=DIGEST_CHECK_SECONDS)
+    # first=1: resume whatever was left unsent before a restart
+    application.job_queue.run_repeating(drain_outbox_job, interval=OUTBOX_DRAIN_SECONDS, first=1)
+    application.job_queue.run_repeating(prune_outbox_job, interval=OUTBOX_PRUNE_SECONDS, first=OUTBOX_PRUNE_SECONDS)
+    application.job_queue.run_repeating(lease_heartbeat, interval=LEASE_TTL_SECONDS / 3, first=0)
+    application.job_queue.run_repeating(
+        snapshot_subscribers, interval=SUBS_SNAPSHOT_SECONDS, first=SUBS_SNAPSHOT_SECONDS
+    )
+    if PREWARM:
+        application.job_queue.run_once(prewarm_job, when=PREWARM_AFTER_SECONDS)
+
+    if not WORKER_POLLING:
+        asyncio.run(run_without_polling(application))
+    elif BOT_MODE == "webhook":
+        wait_for_updates_lease()
+        asyncio.run(run_webhook(
+            application, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+            max_connections=CONCURRENT_UPDATES,
+        ))
+    else:
+        application.run_polling()
 
-    init_db()
-    application.run_polling()
-
-import os
-from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler
 
+@traced
 async def test_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    admin_chat_id = int(os.getenv("ADMIN_CHAT_ID", "0"))
-    
-    if admin_chat_id == 0:
+    admin = admin_chat_id()
+    if admin == 0:
         await update.message.reply_text("ADMIN_CHAT_ID not found")
         return
 
     await context.bot.send_message(
-        chat_id=admin_chat_id,
+        chat_id=admin,
         text="Admin test message ✅"
     )
 
     await update.message.reply_text("Я отправил сообщение в админ-чат ✅")
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ...
-
 # ⬇⬇⬇ ВОТ ЗДЕСЬ ВСТАВИТЬ ⬇⬇⬇
 
+@traced
 async def pdf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    from pdf_gen import generate_profile_pdf  # reportlab is loaded on first use
+
     profile = get_profile(update.effective_user.id)
     if not profile:
         await update.message.reply_text("Profile not found. Use /profile first.")
@@ -9,7 +9,7 @@ from telegram.ext import (
     ContextTypes, filters
 )
 from profile_store import upsert_profile, get_profile
-from pdf_gen import generate_profile_pdf
+from profiling import traced
 
 # States
 (
@@ -51,6 +51,7 @@ def _fmt_preview(d: dict) -> str:
         f"<b>Certificates:</b> {g('certificates')}\n"
     )
 
+@traced
 async def profile_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Call this from your /start menu button "🧾 My Profile".
@@ -66,6 +67,7 @@ async def profile_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text("Profile menu:", reply_markup=kb)
 
+@traced
 async def start_wizard_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -77,31 +79,37 @@ async def _save_text(update: Update, context: ContextTypes.DEFAULT_TYPE, field:
     text = (update.message.text or "").strip()
     context.user_data.setdefault("profile_draft", {})[field] = text
 
+@traced
 async def full_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "full_name")
     await update.message.reply_text("Enter Rank (e.g., AB / OS / 2/O / C/E):")
     return S_RANK
 
+@traced
 async def rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "rank")
     await update.message.reply_text("Enter Nationality (country):")
     return S_NATIONALITY
 
+@traced
 async def nationality(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "nationality")
     await update.message.reply_text("Enter Date of birth (YYYY-MM-DD) or text:")
     return S_DOB
 
+@traced
 async def dob(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "dob")
     await update.message.reply_text("Enter Phone (with country code):")
     return S_PHONE
 
+@traced
 async def phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "phone")
     await update.message.reply_text("Enter WhatsApp (or type 'same' if same as phone):")
     return S_WHATSAPP
 
+@traced
 async def whatsapp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (update.message.text or "").strip()
     if text.lower() == "same":
@@ -110,37 +118,44 @@ async def whatsapp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Enter Email:")
     return S_EMAIL
 
+@traced
 async def email(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "email")
     await update.message.reply_text("English level (e.g., Good / Fluent / Basic):")
     return S_ENGLISH
 
+@traced
 async def english(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "english")
     await update.message.reply_text("Vessel experience (types/years, short):")
     return S_VESSEL_EXP
 
+@traced
 async def vessel_exp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "vessel_exp")
     await update.message.reply_text("Experience / Sea service (free text):")
     return S_EXPERIENCE
 
+@traced
 async def experience(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "experience")
     await update.message.reply_text("Certificates (COC/endorsements/etc.):")
     return S_CERTS
 
+@traced
 async def certificates(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "certificates")
     await update.message.reply_text("Available from (YYYY-MM-DD or text):")
     return S_AVAIL
 
+@traced
 async def available_from(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _save_text(update, context, "available_from")
     d = context.user_data.get("profile_draft", {})
     await update.message.reply_text(_fmt_preview(d), parse_mode=ParseMode.HTML, reply_markup=_kb_confirm())
     return S_CONFIRM
 
+@traced
 async def confirm_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -152,12 +167,14 @@ async def confirm_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]))
     return ConversationHandler.END
 
+@traced
 async def edit_again_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     await q.edit_message_text("Enter Full name (as in passport):")
     return S_FULLNAME
 
+@traced
 async def export_pdf_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -169,12 +186,15 @@ async def export_pdf_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]))
         return ConversationHandler.END
 
+    from pdf_gen import generate_profile_pdf  # reportlab is loaded on first export
+
     pdf = generate_profile_pdf(prof)
     filename = f"profile_{user_id}_{datetime.utcnow().strftime('%Y%m%d')}.pdf"
     await q.message.reply_document(document=pdf, filename=filename, caption="📄 Your profile PDF")
     # keep menu open
     return S_CONFIRM if context.user_data.get("profile_draft") else ConversationHandler.END
 
+@traced
 async def cancel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.callback_query:
         await update.callback_query.answer()
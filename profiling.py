@@ -0,0 +1,198 @@
+# profiling.py
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timezone
+from io import BytesIO
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from admin import require_admin
+
+log = logging.getLogger("crewbot.trace")
+
+# Opt-in: TRACE_UPDATES=1 wraps handlers, SLOW_UPDATE_MS sets the slow threshold.
+TRACE_UPDATES = os.getenv("TRACE_UPDATES", "").strip() in ("1", "true", "yes")
+SLOW_UPDATE_MS = int(os.getenv("SLOW_UPDATE_MS", "500"))
+
+SAMPLE_INTERVAL = 0.005      # 5 ms between stack samples
+SAMPLE_MAX_SECONDS = 120
+
+
+# ---------------- SLOW HANDLER TRACING ----------------
+def _task_stack(task: asyncio.Task) -> str:
+    """
+    Where a suspended task is awaiting, outermost call first. Follows the
+    cr_await chain; Task.get_stack() only returns the outermost frame.
+    """
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return "".join(traceback.format_list(traceback.StackSummary.extract(frames)))
+
+
+class _Watchdog:
+    """
+    Background thread that grabs a stack sample while a handler is running
+    longer than the slow threshold: the handler's own task stack (where it
+    is awaiting) and the event loop thread's stack (what runs instead).
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.active: dict[int, tuple[str, float, int, asyncio.Task | None]] = {}
+        self.samples: dict[int, str] = {}
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.seq = 0
+
+    def begin(self, name: str) -> int:
+        with self.lock:
+            self.seq += 1
+            token = self.seq
+            self.active[token] = (name, time.perf_counter(), threading.get_ident(), asyncio.current_task())
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="slow-update-watchdog", daemon=True)
+            self.thread.start()
+        return token
+
+    def end(self, token: int) -> str | None:
+        with self.lock:
+            self.active.pop(token, None)
+            return self.samples.pop(token, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.threshold / 2)
+            now = time.perf_counter()
+            frames = sys._current_frames()
+            with self.lock:
+                for token, (_name, started, tid, task) in self.active.items():
+                    if token in self.samples or now - started < self.threshold:
+                        continue
+                    parts = []
+                    if task is not None:
+                        parts.append("handler task:\n" + _task_stack(task))
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        parts.append("loop thread:\n" + "".join(traceback.format_stack(frame)))
+                    self.samples[token] = "".join(parts)
+
+
+_watchdog = _Watchdog(SLOW_UPDATE_MS / 1000)
+
+
+def traced(fn):
+    """
+    Decorator for async handlers/jobs: logs wall and CPU time per call and
+    a stack sample for calls slower than SLOW_UPDATE_MS.
+    No-op unless TRACE_UPDATES is enabled.
+    CPU time is thread time of the loop thread, so it includes other
+    coroutines that ran while this handler was awaiting.
+    """
+    if not TRACE_UPDATES:
+        return fn
+
+    name = fn.__qualname__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = _watchdog.begin(name)
+        wall0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            wall_ms = (time.perf_counter() - wall0) * 1000
+            cpu_ms = (time.thread_time() - cpu0) * 1000
+            sample = _watchdog.end(token)
+            if wall_ms >= SLOW_UPDATE_MS:
+                log.warning(
+                    "slow handler %s: wall=%.1fms cpu=%.1fms\n%s",
+                    name, wall_ms, cpu_ms, sample or "(no stack sample captured)",
+                )
+            else:
+                log.info("handler %s: wall=%.1fms cpu=%.1fms", name, wall_ms, cpu_ms)
+
+    return wrapper
+
+
+# ---------------- SAMPLING PROFILER ----------------
+def _frame_stack(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL) -> Counter:
+    """
+    Samples the stacks of all other threads for `seconds`.
+    Returns collapsed stacks ("thread;outer;...;inner" -> count).
+    """
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            stacks[f"{names.get(tid, tid)};{_frame_stack(frame)}"] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed_to_bytes(stacks: Counter) -> BytesIO:
+    """
+    Brendan Gregg's collapsed format: feed to flamegraph.pl or speedscope.app.
+    """
+    buf = BytesIO()
+    for stack, count in stacks.most_common():
+        buf.write(f"{stack} {count}\n".encode("utf-8"))
+    buf.seek(0)
+    return buf
+
+
+async def cmd_sample(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /sample [seconds] — admin only. Profiles the running process and
+    sends the collapsed stacks back as a document.
+    """
+    if not await require_admin(update):
+        return
+
+    try:
+        seconds = float(context.args[0]) if context.args else 10.0
+    except ValueError:
+        await update.message.reply_text("Usage: /sample [seconds]")
+        return
+    seconds = max(1.0, min(seconds, SAMPLE_MAX_SECONDS))
+
+    await update.message.reply_text(f"⏱ Sampling for {seconds:.0f}s...")
+    # the sampler runs in a thread so the event loop keeps serving updates
+    stacks = await asyncio.to_thread(sample_stacks, seconds)
+
+    total = sum(stacks.values())
+    filename = f"crewbot_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.collapsed.txt"
+    await update.message.reply_document(
+        document=collapsed_to_bytes(stacks),
+        filename=filename,
+        caption=f"📈 {total} samples in {seconds:.0f}s (flamegraph.pl / speedscope.app)",
+    )
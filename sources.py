@@ -0,0 +1,282 @@
+# sources.py
+from __future__ import annotations
+
+import asyncio
+from abc import ABC, abstractmethod
+import hashlib
+import os
+import re
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+USER_AGENT = "crewbot/1.0 (Telegram bot)"
+
+
+# requests/bs4/lxml cost ~100ms to import and are only needed once a poll
+# runs, so they are loaded on first use (or by prewarm()).
+def _http_get(url: str) -> str:
+    import requests
+
+    r = requests.get(url, timeout=25, headers={"User-Agent": USER_AGENT})
+    r.raise_for_status()
+    return r.text
+
+
+def _soup(html: str) -> BeautifulSoup:
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, "lxml")
+
+
+def prewarm():
+    """Imports the scraping stack ahead of the first poll."""
+    import bs4.builder._lxml  # noqa: F401
+    import requests  # noqa: F401
+
+
+# ---------------- PARSE HELPERS ----------------
+def _clean(s: str) -> str:
+    return re.sub(r"\s+", " ", (s or "")).strip()
+
+
+def _norm_key(s: str) -> str:
+    s = _clean(s).lower()
+    s = s.replace(":", "")
+    return s
+
+
+def parse_detail_pairs(soup: BeautifulSoup) -> dict[str, str]:
+    """
+    Tries to extract key/value pairs from common HTML patterns:
+    - table rows (th/td)
+    - dt/dd definition lists
+    """
+    pairs: dict[str, str] = {}
+
+    # tables
+    for tr in soup.select("tr"):
+        th = tr.find("th")
+        td = tr.find("td")
+        if th and td:
+            k = _norm_key(th.get_text(" ", strip=True))
+            v = _clean(td.get_text(" ", strip=True))
+            if k and v:
+                pairs[k] = v
+
+    # dt/dd
+    for dl in soup.select("dl"):
+        dts = dl.find_all("dt")
+        for dt in dts:
+            dd = dt.find_next_sibling("dd")
+            if dd:
+                k = _norm_key(dt.get_text(" ", strip=True))
+                v = _clean(dd.get_text(" ", strip=True))
+                if k and v:
+                    pairs[k] = v
+
+    return pairs
+
+
+def guess_details_from_text(text: str) -> dict[str, str]:
+    """
+    Fallback: regex search in full page text.
+    """
+    out: dict[str, str] = {}
+    t = _clean(text)
+
+    # Common labels
+    patterns = {
+        "rank": [
+            r"(rank|position)\s*[:\-]\s*([A-Za-z0-9/ &\.\-]+)",
+        ],
+        "vessel": [
+            r"(vessel|vessel type|ship type)\s*[:\-]\s*([A-Za-z0-9/ &\.\-]+)",
+        ],
+        "salary": [
+            r"(salary|wage)\s*[:\-]\s*([A-Za-z0-9/ €$£\.\-,]+)",
+        ],
+        "contract": [
+            r"(contract|contract duration)\s*[:\-]\s*([A-Za-z0-9/ &\.\-]+)",
+        ],
+    }
+
+    for field, pats in patterns.items():
+        for p in pats:
+            m = re.search(p, t, flags=re.IGNORECASE)
+            if m:
+                out[field] = _clean(m.group(2))
+                break
+
+    return out
+
+
+def details_from_soup(soup: BeautifulSoup, url: str) -> dict[str, str]:
+    """
+    Rank/Vessel/Salary/Contract from a detail page: labelled pairs first,
+    then a regex guess over the page text.
+    """
+    # 1) extract pairs from tables/dl
+    pairs = parse_detail_pairs(soup)
+
+    # map keys to our fields (different sites use different labels)
+    def pick(*keys: str) -> str | None:
+        for k in keys:
+            nk = _norm_key(k)
+            for kk, vv in pairs.items():
+                if kk == nk:
+                    return vv
+        return None
+
+    rank = pick("Rank", "Position", "Post", "Vacancy", "Job title")
+    vessel = pick("Vessel", "Vessel type", "Ship type", "Type of vessel")
+    salary = pick("Salary", "Wage", "Salary per month", "Monthly salary")
+    contract = pick("Contract", "Contract duration", "Duration", "Period")
+
+    # 2) fallback from full text if something missing
+    text = soup.get_text(" ", strip=True)
+    guessed = guess_details_from_text(text)
+
+    rank = rank or guessed.get("rank")
+    vessel = vessel or guessed.get("vessel")
+    salary = salary or guessed.get("salary")
+    contract = contract or guessed.get("contract")
+
+    # final cleanup / defaults
+    rank = rank or "Unknown"
+    vessel = vessel or "Unknown"
+    salary = salary or "Negotiable"
+    contract = contract or "Unknown"
+
+    return {
+        "rank": _clean(rank),
+        "vessel": _clean(vessel),
+        "salary": _clean(salary),
+        "contract": _clean(contract),
+        "url": url,
+    }
+
+
+def fingerprint(d: dict[str, str]) -> str:
+    """Source-independent identity of a vacancy, used for cross-source dedup."""
+    key = "|".join(_norm_key(d.get(f, "")) for f in ("rank", "vessel", "salary", "contract"))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+# ---------------- SOURCE PLUGINS ----------------
+class VacancySource(ABC):
+    """
+    A job site. Subclasses set name and implement list_ids(), vacancy_link()
+    and parse(); a subclass missing one can't be instantiated, so a broken
+    source fails when SOURCES is built. The default fetch_details()
+    downloads vacancy_link(id) and hands the HTML to parse().
+    Vacancy ids are strings so sources are free in their id format.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def list_ids(self, limit: int = 30) -> list[str]:
+        ...
+
+    @abstractmethod
+    def vacancy_link(self, vacancy_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def parse(self, html: str, url: str) -> dict[str, str]:
+        ...
+
+    def fetch_details(self, vacancy_id: str) -> dict[str, str]:
+        url = self.vacancy_link(vacancy_id)
+        return self.parse(_http_get(url), url)
+
+
+class CrewOnBoardSource(VacancySource):
+    name = "crewonboard"
+    base_url = "https://crewonboard.net/"
+    vac_re = re.compile(r"/vacancy/detail/(\d+)", re.IGNORECASE)
+
+    def list_ids(self, limit: int = 30) -> list[str]:
+        """Strictly loads base_url and extracts vacancy IDs from links like /vacancy/detail/12345"""
+        soup = _soup(_http_get(self.base_url))
+        ids: list[str] = []
+
+        for a in soup.select("a[href]"):
+            href = a.get("href") or ""
+            m = self.vac_re.search(href)
+            if m:
+                ids.append(m.group(1))
+
+        # unique keep order
+        return list(dict.fromkeys(ids))[:limit]
+
+    def vacancy_link(self, vacancy_id: str) -> str:
+        return f"{self.base_url}vacancy/detail/{vacancy_id}"
+
+    def parse(self, html: str, url: str) -> dict[str, str]:
+        return details_from_soup(_soup(html), url)
+
+
+SOURCES: dict[str, VacancySource] = {
+    s.name: s for s in (CrewOnBoardSource(),)
+}
+
+
+def enabled_sources() -> list[VacancySource]:
+    """VACANCY_SOURCES=name1,name2 (default: all registered sources)."""
+    names = [n.strip() for n in os.getenv("VACANCY_SOURCES", "").split(",") if n.strip()]
+    if not names:
+        return list(SOURCES.values())
+    unknown = [n for n in names if n not in SOURCES]
+    if unknown:
+        raise RuntimeError(f"Unknown VACANCY_SOURCES: {', '.join(unknown)}")
+    return [SOURCES[n] for n in names]
+
+
+# ---------------- POLLING ----------------
+def _poll_source(
+    source: VacancySource,
+    filter_new: Callable[[str, list[str]], list[str]],
+    list_limit: int,
+    max_new: int,
+) -> list[dict[str, str]]:
+    ids = filter_new(source.name, source.list_ids(limit=list_limit))
+    out = []
+    for vid in ids[:max_new]:
+        try:
+            d = source.fetch_details(vid)
+        except Exception:
+            # stays unseen, retried on the next poll
+            continue
+        d["source"] = source.name
+        d["id"] = vid
+        d["fingerprint"] = fingerprint(d)
+        out.append(d)
+    return out
+
+
+async def poll_sources(
+    sources: list[VacancySource],
+    filter_new: Callable[[str, list[str]], list[str]],
+    list_limit: int = 30,
+    max_new: int = 10,
+) -> list[dict[str, str]]:
+    """
+    Polls all sources concurrently (one thread each) and merges the new
+    vacancies into one stream. filter_new(source_name, ids) returns the
+    unseen ids. A failing source is skipped for this poll. Cross-source
+    duplicates are dropped when publishing (see subs_store.publish_vacancy).
+    """
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_poll_source, s, filter_new, list_limit, max_new) for s in sources),
+        return_exceptions=True,
+    )
+
+    merged = []
+    for res in results:
+        if isinstance(res, BaseException):
+            continue
+        merged.extend(res)
+    return merged
@@ -0,0 +1,149 @@
+# subs_registry.py
+from __future__ import annotations
+
+import json
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import compress
+
+SNAPSHOT_MAGIC = b"CRWSUBS1"
+_HEADER = struct.Struct("<8sqI")  # magic, subscriber count, length of the names JSON
+
+
+class SubscriberRegistry:
+    """
+    Every subscription as three parallel arrays sorted by chat_id: 8 bytes
+    of chat_id plus one byte of rank filter and one of delivery mode per
+    subscriber, instead of a tuple of Python objects each.
+
+    Rank filters and modes are interned: a rank byte indexes rank_names
+    (0 = no filter), a mode byte indexes modes.
+    """
+
+    def __init__(self, modes: tuple[str, ...], version: int = 0):
+        self.modes = modes
+        self.version = version
+        self.chat_ids = array("q")
+        self.ranks = array("B")
+        self.mode_ids = array("B")
+        self.rank_names: list[str | None] = [None]
+        self._rank_ids: dict[str | None, int] = {None: 0}
+        self._mode_ids = {m: i for i, m in enumerate(modes)}
+
+    def __len__(self) -> int:
+        return len(self.chat_ids)
+
+    def _rank_id(self, rank: str | None) -> int:
+        rank = rank or None
+        rid = self._rank_ids.get(rank)
+        if rid is None:
+            rid = len(self.rank_names)
+            if rid > 255:
+                raise ValueError("more than 255 distinct rank filters")
+            self.rank_names.append(rank)
+            self._rank_ids[rank] = rid
+        return rid
+
+    def _index(self, chat_id: int) -> int | None:
+        i = bisect_left(self.chat_ids, chat_id)
+        if i < len(self.chat_ids) and self.chat_ids[i] == chat_id:
+            return i
+        return None
+
+    # ---------------- writes ----------------
+    def put(self, chat_id: int, rank: str | None, mode: str):
+        rid = self._rank_id(rank)
+        mid = self._mode_ids[mode]
+        i = bisect_left(self.chat_ids, chat_id)
+        if i < len(self.chat_ids) and self.chat_ids[i] == chat_id:
+            self.ranks[i] = rid
+            self.mode_ids[i] = mid
+            return
+        self.chat_ids.insert(i, chat_id)
+        self.ranks.insert(i, rid)
+        self.mode_ids.insert(i, mid)
+
+    def remove(self, chat_id: int):
+        i = self._index(chat_id)
+        if i is not None:
+            del self.chat_ids[i]
+            del self.ranks[i]
+            del self.mode_ids[i]
+
+    # ---------------- reads ----------------
+    def get(self, chat_id: int) -> tuple[str | None, str] | None:
+        """(rank_filter, delivery_mode), like subs_store.sub_get."""
+        i = self._index(chat_id)
+        if i is None:
+            return None
+        return self.rank_names[self.ranks[i]], self.modes[self.mode_ids[i]]
+
+    def match(self, vacancy_rank: str) -> dict[str, list[int]]:
+        """
+        chat_ids whose rank filter matches vacancy_rank (case-insensitive
+        contains, no filter matches everything), grouped by delivery mode.
+        """
+        v = vacancy_rank.lower()
+        # one decision per distinct filter, then a C-level pass over the ranks
+        table = bytes(not name or name.lower() in v for name in self.rank_names).ljust(256, b"\0")
+        mask = self.ranks.tobytes().translate(table)
+
+        matched: list[list[int]] = [[] for _ in self.modes]
+        for chat_id, mid in compress(zip(self.chat_ids, self.mode_ids), mask):
+            matched[mid].append(chat_id)
+        return dict(zip(self.modes, matched))
+
+    # ---------------- load / snapshot ----------------
+    @classmethod
+    def from_rows(cls, rows, modes: tuple[str, ...], version: int) -> SubscriberRegistry:
+        """rows: (chat_id, rank_filter, delivery_mode) in chat_id order."""
+        reg = cls(modes, version)
+        rank_id, mode_ids = reg._rank_id, reg._mode_ids
+        for chat_id, rank, mode in rows:
+            reg.chat_ids.append(chat_id)
+            reg.ranks.append(rank_id(rank))
+            reg.mode_ids.append(mode_ids[mode])
+        return reg
+
+    def to_bytes(self) -> bytes:
+        names = json.dumps({
+            "rank_names": self.rank_names,
+            "modes": self.modes,
+            "byteorder": sys.byteorder,
+        }).encode("utf-8")
+        return b"".join((
+            _HEADER.pack(SNAPSHOT_MAGIC, len(self.chat_ids), len(names)),
+            names,
+            self.chat_ids.tobytes(),
+            self.ranks.tobytes(),
+            self.mode_ids.tobytes(),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, modes: tuple[str, ...], version: int) -> SubscriberRegistry | None:
+        """None if data is not a snapshot taken with the same delivery modes."""
+        if len(data) < _HEADER.size:
+            return None
+        magic, count, names_len = _HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            return None
+        pos = _HEADER.size
+        names = json.loads(data[pos:pos + names_len])
+        if tuple(names["modes"]) != modes:
+            return None
+        pos += names_len
+
+        reg = cls(modes, version)
+        reg.chat_ids.frombytes(data[pos:pos + count * 8])
+        if names["byteorder"] != sys.byteorder:
+            reg.chat_ids.byteswap()
+        pos += count * 8
+        reg.ranks.frombytes(data[pos:pos + count])
+        reg.mode_ids.frombytes(data[pos + count:pos + 2 * count])
+        if len(reg.mode_ids) != count:
+            return None
+        for rank in names["rank_names"][1:]:
+            reg._rank_id(rank)
+        return reg
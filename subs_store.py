@@ -0,0 +1,763 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from subs_registry import SubscriberRegistry
+
+DB_PATH = "crewbot.sqlite"
+
+DELIVERY_MODES = ("instant", "hourly", "daily")
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_KEEP_DAYS = 7
+OUTBOX_PRUNE_BATCH = 5000  # rows per delete, so other writers get the lock in between
+
+# Several worker processes may share DB_PATH: wait for each other's locks
+BUSY_TIMEOUT_SECONDS = 30
+
+_schema_ready = False
+_local = threading.local()  # one connection per thread, see db()
+
+# this process's copy of all subscriptions, see sub_registry()
+_registry: SubscriberRegistry | None = None
+_snapshot_version: int | None = None
+
+
+# ---------------- DB ----------------
+def db():
+    """
+    This thread's connection, opened on first use and kept: callers don't
+    close it. A transaction left open by a caller that raised is rolled back.
+    """
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_SECONDS)
+        _local.conn, _local.path = conn, DB_PATH
+    elif conn.in_transaction:
+        conn.rollback()
+    if not _schema_ready:
+        _init_schema(conn)
+        _schema_ready = True
+    return conn
+
+
+def init_subs_db():
+    """Creates/migrates the tables at startup instead of on the first query."""
+    db()
+
+
+def _init_schema(conn: sqlite3.Connection):
+    """Creates/migrates tables once per process; BEGIN IMMEDIATE serializes racing workers."""
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            rank_filter TEXT DEFAULT NULL,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    if "seen_source_vacancies" not in tables:
+        conn.execute(
+            """
+            CREATE TABLE seen_source_vacancies (
+                source TEXT NOT NULL,
+                vacancy_id TEXT NOT NULL,
+                fingerprint TEXT DEFAULT NULL,
+                first_seen_at TEXT NOT NULL,
+                PRIMARY KEY (source, vacancy_id)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX idx_seen_fingerprint ON seen_source_vacancies(fingerprint)")
+        # ids seen before sources existed all came from crewonboard
+        if "seen_vacancies" in tables:
+            conn.execute(
+                """
+                INSERT INTO seen_source_vacancies(source, vacancy_id, first_seen_at)
+                SELECT 'crewonboard', CAST(vacancy_id AS TEXT), first_seen_at FROM seen_vacancies
+                """
+            )
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(subscriptions)")}
+    if "delivery_mode" not in cols:
+        conn.execute("ALTER TABLE subscriptions ADD COLUMN delivery_mode TEXT NOT NULL DEFAULT 'instant'")
+    # digest text of each vacancy, stored once however many subscribers queue it
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS digest_entries (
+            vacancy_key TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    # vacancies waiting for the next hourly/daily digest of a subscriber
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS digest_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            vacancy_key TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            queued_at TEXT NOT NULL,
+            UNIQUE (chat_id, vacancy_key)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_digest_queue_mode ON digest_queue(mode, chat_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_digest_queue_key ON digest_queue(vacancy_key)")
+    # last completed flush per digest mode (unix time), so windows survive restarts
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS digest_flushes (
+            mode TEXT PRIMARY KEY,
+            flushed_at REAL NOT NULL
+        )
+        """
+    )
+    # messages waiting to be sent; idem_key makes re-enqueueing a no-op
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idem_key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            sent_at TEXT DEFAULT NULL,
+            failed_at TEXT DEFAULT NULL,
+            claimed_by TEXT DEFAULT NULL,
+            claimed_until REAL DEFAULT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(id) WHERE sent_at IS NULL AND failed_at IS NULL"
+    )
+    # for outbox_prune
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox(sent_at) WHERE sent_at IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_failed ON outbox(failed_at) WHERE failed_at IS NOT NULL")
+    # named leases (e.g. "scheduler") held by one worker until expires_at (unix time)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    # incrementally maintained aggregates for /analytics: (metric, key) -> value
+    if "stats" not in tables:
+        conn.execute(
+            """
+            CREATE TABLE stats (
+                metric TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (metric, key)
+            )
+            """
+        )
+        _backfill_stats(conn)
+    # named counters; "subscriptions" is bumped by every subscription write
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """
+    )
+    # chat_ids changed by each subscriptions version, replayed by sub_registry();
+    # entries up to counters "subs_changes_pruned" are covered by the snapshot
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS subs_changes (
+            version INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL
+        )
+        """
+    )
+    # latest SubscriberRegistry snapshot, as of its version
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS subs_snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            taken_at TEXT NOT NULL
+        )
+        """
+    )
+    # per-chat menu state, shared by all workers (instead of context.user_data)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chat_state (
+            chat_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.commit()
+
+
+def _sub_ensure(conn: sqlite3.Connection, chat_id: int) -> bool:
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO subscriptions(chat_id, rank_filter, created_at) VALUES(?, NULL, ?)",
+        (chat_id, datetime.now(timezone.utc).isoformat()),
+    )
+    if cur.rowcount != 1:
+        return False
+    _bump(conn, "subscribers_by_rank", "Any")
+    _bump(conn, "subscribers_by_mode", "instant")
+    return True
+
+
+def _counter(conn: sqlite3.Connection, name: str) -> int:
+    row = conn.execute("SELECT value FROM counters WHERE name=?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def _subs_changed(conn: sqlite3.Connection, chat_id: int) -> int:
+    """
+    Bumps the subscriptions version and logs chat_id under it, inside the
+    caller's transaction; returns the new version.
+    """
+    version = conn.execute(
+        "INSERT INTO counters(name, value) VALUES('subscriptions', 1) "
+        "ON CONFLICT(name) DO UPDATE SET value=value+1 RETURNING value"
+    ).fetchone()[0]
+    conn.execute("INSERT INTO subs_changes(version, chat_id) VALUES(?, ?)", (version, chat_id))
+    return version
+
+
+def _registry_apply(version: int, chat_id: int, row: tuple[str | None, str] | None):
+    """
+    Write-through after commit. Only if the registry was current just
+    before this write; otherwise another worker wrote in between and
+    sub_registry() reloads on its next call.
+    """
+    if _registry is None or _registry.version != version - 1:
+        return
+    if row is None:
+        _registry.remove(chat_id)
+    else:
+        _registry.put(chat_id, *row)
+    _registry.version = version
+
+
+def sub_add(chat_id: int):
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    version = _subs_changed(conn, chat_id) if _sub_ensure(conn, chat_id) else None
+    conn.commit()
+    if version is not None:
+        _registry_apply(version, chat_id, (None, "instant"))
+
+
+def sub_remove(chat_id: int):
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute(
+        "SELECT rank_filter, delivery_mode FROM subscriptions WHERE chat_id=?", (chat_id,)
+    ).fetchone()
+    version = None
+    if row is not None:
+        conn.execute("DELETE FROM subscriptions WHERE chat_id=?", (chat_id,))
+        _bump(conn, "subscribers_by_rank", row[0] or "Any", -1)
+        _bump(conn, "subscribers_by_mode", row[1], -1)
+        version = _subs_changed(conn, chat_id)
+    conn.execute("DELETE FROM digest_queue WHERE chat_id=?", (chat_id,))
+    conn.commit()
+    if version is not None:
+        _registry_apply(version, chat_id, None)
+
+
+def sub_set_rank(chat_id: int, rank: str | None):
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    changed = _sub_ensure(conn, chat_id)
+    old, mode = conn.execute(
+        "SELECT rank_filter, delivery_mode FROM subscriptions WHERE chat_id=?", (chat_id,)
+    ).fetchone()
+    if old != rank:
+        conn.execute("UPDATE subscriptions SET rank_filter=? WHERE chat_id=?", (rank, chat_id))
+        _bump(conn, "subscribers_by_rank", old or "Any", -1)
+        _bump(conn, "subscribers_by_rank", rank or "Any")
+        changed = True
+    version = _subs_changed(conn, chat_id) if changed else None
+    conn.commit()
+    if version is not None:
+        _registry_apply(version, chat_id, (rank, mode))
+
+
+def sub_set_mode(chat_id: int, mode: str):
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"unknown delivery mode: {mode}")
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    changed = _sub_ensure(conn, chat_id)
+    rank, old = conn.execute(
+        "SELECT rank_filter, delivery_mode FROM subscriptions WHERE chat_id=?", (chat_id,)
+    ).fetchone()
+    if old != mode:
+        conn.execute("UPDATE subscriptions SET delivery_mode=? WHERE chat_id=?", (mode, chat_id))
+        _bump(conn, "subscribers_by_mode", old, -1)
+        _bump(conn, "subscribers_by_mode", mode)
+        changed = True
+    version = _subs_changed(conn, chat_id) if changed else None
+    conn.commit()
+    if version is not None:
+        _registry_apply(version, chat_id, (rank, mode))
+
+
+def sub_get(chat_id: int):
+    """(rank_filter, delivery_mode) or None if not subscribed."""
+    conn = db()
+    row = conn.execute(
+        "SELECT rank_filter, delivery_mode FROM subscriptions WHERE chat_id=?", (chat_id,)
+    ).fetchone()
+    return row
+
+
+def sub_list():
+    conn = db()
+    rows = conn.execute("SELECT chat_id, rank_filter, delivery_mode FROM subscriptions").fetchall()
+    return rows
+
+
+# ---------------- SUBSCRIBER REGISTRY ----------------
+def sub_registry() -> SubscriberRegistry:
+    """
+    All subscriptions, kept in memory and updated write-through by the
+    sub_* functions. Changes made by other workers are replayed from the
+    subs_changes log, so a call costs one indexed read plus the changed
+    rows. The first call starts from the stored snapshot (a full scan of
+    subscriptions only if there is none) and replays from its version.
+    """
+    global _registry
+    conn = db()
+    conn.execute("BEGIN")  # version, log and rows from one read snapshot
+    version = _counter(conn, "subscriptions")
+    pruned = _counter(conn, "subs_changes_pruned")
+
+    reg = _registry
+    if reg is not None and not pruned <= reg.version <= version:
+        reg = None  # the log doesn't reach back that far (or the DB was replaced)
+    if reg is None:
+        snap = conn.execute("SELECT version, data FROM subs_snapshot WHERE id=1").fetchone()
+        if snap is not None and pruned <= snap[0] <= version:
+            reg = SubscriberRegistry.from_bytes(snap[1], DELIVERY_MODES, snap[0])
+    if reg is None:
+        rows = conn.execute("SELECT chat_id, rank_filter, delivery_mode FROM subscriptions ORDER BY chat_id")
+        reg = SubscriberRegistry.from_rows(rows, DELIVERY_MODES, version)
+
+    if reg.version < version:
+        # current row of every chat changed since; no row means unsubscribed
+        rows = conn.execute(
+            """
+            SELECT c.chat_id, s.rank_filter, s.delivery_mode
+            FROM (SELECT DISTINCT chat_id FROM subs_changes WHERE version>?) c
+            LEFT JOIN subscriptions s ON s.chat_id=c.chat_id
+            """,
+            (reg.version,),
+        )
+        for chat_id, rank, mode in rows:
+            if mode is None:
+                reg.remove(chat_id)
+            else:
+                reg.put(chat_id, rank, mode)
+        reg.version = version
+    conn.commit()
+    _registry = reg
+    return reg
+
+
+def sub_registry_snapshot() -> bool:
+    """
+    Stores this process's registry (if it has loaded one) for the next
+    start and prunes the change log it covers. False if nothing was stored.
+    """
+    global _snapshot_version
+    if _registry is None:
+        return False
+    reg = sub_registry()
+    if reg.version == _snapshot_version:
+        return False
+    data = reg.to_bytes()
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    cur = conn.execute(
+        """
+        INSERT INTO subs_snapshot(id, version, data, taken_at) VALUES(1, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET version=excluded.version, data=excluded.data, taken_at=excluded.taken_at
+        WHERE subs_snapshot.version<excluded.version
+        """,
+        (reg.version, data, datetime.now(timezone.utc).isoformat()),
+    )
+    stored = cur.rowcount == 1
+    if stored:
+        conn.execute("DELETE FROM subs_changes WHERE version<=?", (reg.version,))
+        conn.execute(
+            "INSERT INTO counters(name, value) VALUES('subs_changes_pruned', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value=MAX(value, excluded.value)",
+            (reg.version,),
+        )
+    conn.commit()
+    _snapshot_version = reg.version
+    return stored
+
+
+def seen_filter_new(source: str, vacancy_ids: list[str]) -> list[str]:
+    """Returns the ids of `source` not seen yet, in input order. Does not mark anything."""
+    if not vacancy_ids:
+        return []
+    conn = db()
+    marks = ",".join("?" * len(vacancy_ids))
+    seen = {
+        r[0] for r in conn.execute(
+            f"SELECT vacancy_id FROM seen_source_vacancies WHERE source=? AND vacancy_id IN ({marks})",
+            [source, *vacancy_ids],
+        )
+    }
+    return [vid for vid in vacancy_ids if vid not in seen]
+
+
+def publish_vacancy(
+    vacancy: dict[str, str],
+    text: str,
+    instant_chat_ids: list[int],
+    digest_rows: list[tuple[int, str]],
+    digest_text: str,
+) -> bool:
+    """
+    Marks the vacancy (a sources.poll_sources item) seen and enqueues all
+    its deliveries in one transaction. digest_rows: (chat_id, mode), all
+    sharing the one digest_text entry.
+    False if nothing was enqueued: the vacancy was already seen, or another
+    source already published one with the same fingerprint.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    source, vacancy_id, fingerprint = vacancy["source"], vacancy["id"], vacancy["fingerprint"]
+    key = f"{source}:{vacancy_id}"
+    conn = db()
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO seen_source_vacancies(source, vacancy_id, fingerprint, first_seen_at) "
+            "VALUES(?, ?, ?, ?)",
+            (source, vacancy_id, fingerprint, now),
+        )
+        if cur.rowcount == 0:
+            return False
+        dup = conn.execute(
+            "SELECT 1 FROM seen_source_vacancies WHERE fingerprint=? AND source<>? LIMIT 1",
+            (fingerprint, source),
+        ).fetchone()
+        if dup:
+            _bump(conn, "vacancies", "duplicate")
+            return False
+        _bump(conn, "vacancies", "published")
+        _bump(conn, "vacancies_by_rank", vacancy["rank"])
+        conn.executemany(
+            "INSERT OR IGNORE INTO outbox(idem_key, chat_id, text, created_at) VALUES(?, ?, ?, ?)",
+            [(f"vac:{key}:{chat_id}", chat_id, text, now) for chat_id in instant_chat_ids],
+        )
+        if digest_rows:
+            conn.execute(
+                "INSERT OR IGNORE INTO digest_entries(vacancy_key, text, created_at) VALUES(?, ?, ?)",
+                (key, digest_text, now),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO digest_queue(chat_id, vacancy_key, mode, queued_at) VALUES(?, ?, ?, ?)",
+                [(chat_id, key, mode, now) for chat_id, mode in digest_rows],
+            )
+    return True
+
+
+# ---------------- DIGEST QUEUE ----------------
+def digest_pending(mode: str, after_chat_id: int | None = None, limit: int = 500) -> dict[int, list[tuple[int, str]]]:
+    """
+    chat_id -> [(queue_id, text), ...] in arrival order, for the next
+    `limit` chats after after_chat_id; page through a mode by passing the
+    last chat_id returned.
+    """
+    conn = db()
+    rows = conn.execute(
+        """
+        SELECT q.id, q.chat_id, e.text
+        FROM digest_queue q JOIN digest_entries e ON e.vacancy_key=q.vacancy_key
+        WHERE q.mode=? AND q.chat_id IN (
+            SELECT DISTINCT chat_id FROM digest_queue
+            WHERE mode=? AND (? IS NULL OR chat_id>?) ORDER BY chat_id LIMIT ?
+        )
+        ORDER BY q.chat_id, q.id
+        """,
+        (mode, mode, after_chat_id, after_chat_id, limit),
+    ).fetchall()
+
+    out: dict[int, list[tuple[int, str]]] = {}
+    for qid, chat_id, text in rows:
+        out.setdefault(chat_id, []).append((qid, text))
+    return out
+
+
+def digest_commit(chat_id: int, mode: str, upto_id: int, messages: list[str]):
+    """Moves a subscriber's digest into the outbox and clears its queue rows in one transaction."""
+    now = datetime.now(timezone.utc).isoformat()
+    conn = db()
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO outbox(idem_key, chat_id, text, created_at) VALUES(?, ?, ?, ?)",
+            [(f"digest:{mode}:{chat_id}:{upto_id}:{i}", chat_id, msg, now) for i, msg in enumerate(messages)],
+        )
+        conn.execute("DELETE FROM digest_queue WHERE chat_id=? AND mode=? AND id<=?", (chat_id, mode, upto_id))
+
+
+def digest_last_flush(mode: str) -> float | None:
+    conn = db()
+    row = conn.execute("SELECT flushed_at FROM digest_flushes WHERE mode=?", (mode,)).fetchone()
+    return row[0] if row else None
+
+
+def digest_mark_flushed(mode: str, at: float):
+    """Records a completed flush and drops entries no queue row refers to anymore."""
+    conn = db()
+    with conn:
+        conn.execute(
+            "INSERT INTO digest_flushes(mode, flushed_at) VALUES(?, ?) "
+            "ON CONFLICT(mode) DO UPDATE SET flushed_at=excluded.flushed_at",
+            (mode, at),
+        )
+        conn.execute(
+            "DELETE FROM digest_entries WHERE NOT EXISTS "
+            "(SELECT 1 FROM digest_queue q WHERE q.vacancy_key=digest_entries.vacancy_key)"
+        )
+
+
+# ---------------- OUTBOX ----------------
+def outbox_claim(worker_id: str, limit: int = 500, claim_seconds: float = 120) -> list[tuple[int, int, str]]:
+    """
+    Claims up to `limit` unsent messages for this worker, oldest first, and
+    returns them as (id, chat_id, text). Rows claimed by another worker are
+    skipped until that claim expires, so concurrent workers split the outbox
+    between them; a crashed worker's rows become claimable again.
+    """
+    now = time.time()
+    until = now + claim_seconds
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(
+        """
+        UPDATE outbox SET claimed_by=?, claimed_until=?
+        WHERE id IN (
+            SELECT id FROM outbox
+            WHERE sent_at IS NULL AND failed_at IS NULL
+              AND (claimed_until IS NULL OR claimed_until < ?)
+            ORDER BY id LIMIT ?
+        )
+        """,
+        (worker_id, until, now, limit),
+    )
+    rows = conn.execute(
+        "SELECT id, chat_id, text FROM outbox WHERE claimed_by=? AND claimed_until=? ORDER BY id",
+        (worker_id, until),
+    ).fetchall()
+    conn.commit()
+    return rows
+
+
+def outbox_mark_sent(outbox_id: int):
+    conn = db()
+    cur = conn.execute(
+        "UPDATE outbox SET sent_at=?, attempts=attempts+1 WHERE id=? AND sent_at IS NULL",
+        (datetime.now(timezone.utc).isoformat(), outbox_id),
+    )
+    if cur.rowcount == 1:
+        _bump(conn, "notifications", "sent")
+    conn.commit()
+
+
+def outbox_mark_failed(outbox_id: int, permanent: bool = False):
+    """Counts a failed attempt; gives up after OUTBOX_MAX_ATTEMPTS or on a permanent error."""
+    conn = db()
+    conn.execute(
+        """
+        UPDATE outbox SET attempts=attempts+1,
+            failed_at=CASE WHEN ? OR attempts+1>=? THEN ? ELSE NULL END
+        WHERE id=?
+        """,
+        (permanent, OUTBOX_MAX_ATTEMPTS, datetime.now(timezone.utc).isoformat(), outbox_id),
+    )
+    gave_up = conn.execute("SELECT failed_at IS NOT NULL FROM outbox WHERE id=?", (outbox_id,)).fetchone()
+    if gave_up and gave_up[0]:
+        _bump(conn, "notifications", "failed")
+    conn.commit()
+
+
+def outbox_extend_claim(worker_id: str, outbox_ids: list[int], claim_seconds: float = 120) -> set[int]:
+    """
+    Pushes back this worker's claim on rows it is still sending. Returns
+    the ids still claimed by it; rows whose claim already expired and were
+    taken by another worker are left alone.
+    """
+    if not outbox_ids:
+        return set()
+    marks = ",".join("?" * len(outbox_ids))
+    conn = db()
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(
+        f"UPDATE outbox SET claimed_until=? WHERE claimed_by=? AND sent_at IS NULL AND id IN ({marks})",
+        [time.time() + claim_seconds, worker_id, *outbox_ids],
+    )
+    mine = {
+        r[0] for r in conn.execute(
+            f"SELECT id FROM outbox WHERE claimed_by=? AND sent_at IS NULL AND id IN ({marks})",
+            [worker_id, *outbox_ids],
+        )
+    }
+    conn.commit()
+    return mine
+
+
+def outbox_release(worker_id: str, outbox_ids: list[int]):
+    """Gives claimed rows back without counting an attempt, e.g. while Telegram is unreachable."""
+    if not outbox_ids:
+        return
+    marks = ",".join("?" * len(outbox_ids))
+    conn = db()
+    conn.execute(
+        f"UPDATE outbox SET claimed_by=NULL, claimed_until=NULL WHERE claimed_by=? AND id IN ({marks})",
+        [worker_id, *outbox_ids],
+    )
+    conn.commit()
+
+
+def outbox_prune() -> int:
+    """Drops delivered/failed rows older than OUTBOX_KEEP_DAYS; returns how many."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=OUTBOX_KEEP_DAYS)).isoformat()
+    deleted = 0
+    conn = db()
+    for column in ("sent_at", "failed_at"):
+        while True:
+            cur = conn.execute(
+                f"DELETE FROM outbox WHERE id IN (SELECT id FROM outbox WHERE {column}<? LIMIT ?)",
+                (cutoff, OUTBOX_PRUNE_BATCH),
+            )
+            conn.commit()
+            deleted += cur.rowcount
+            if cur.rowcount < OUTBOX_PRUNE_BATCH:
+                break
+    return deleted
+
+
+# ---------------- LEASES ----------------
+def lease_acquire(name: str, holder: str, ttl: float) -> bool:
+    """Takes or renews lease `name` for `holder`. False if someone else holds an unexpired one."""
+    now = time.time()
+    conn = db()
+    cur = conn.execute(
+        """
+        INSERT INTO leases(name, holder, expires_at) VALUES(?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+        WHERE leases.holder=excluded.holder OR leases.expires_at<?
+        """,
+        (name, holder, now + ttl, now),
+    )
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def lease_held(name: str, holder: str) -> bool:
+    conn = db()
+    row = conn.execute(
+        "SELECT 1 FROM leases WHERE name=? AND holder=? AND expires_at>=?", (name, holder, time.time())
+    ).fetchone()
+    return row is not None
+
+
+def lease_release(name: str, holder: str):
+    conn = db()
+    conn.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+    conn.commit()
+
+
+# ---------------- CHAT STATE ----------------
+def chat_state_get(chat_id: int) -> str | None:
+    conn = db()
+    row = conn.execute("SELECT state FROM chat_state WHERE chat_id=?", (chat_id,)).fetchone()
+    return row[0] if row else None
+
+
+def chat_state_set(chat_id: int, state: str | None):
+    conn = db()
+    if state is None:
+        conn.execute("DELETE FROM chat_state WHERE chat_id=?", (chat_id,))
+    else:
+        conn.execute(
+            "INSERT INTO chat_state(chat_id, state, updated_at) VALUES(?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at",
+            (chat_id, state, datetime.now(timezone.utc).isoformat()),
+        )
+    conn.commit()
+
+
+# ---------------- STATS ----------------
+def _bump(conn: sqlite3.Connection, metric: str, key: str, delta: int = 1):
+    """Adds delta to one aggregate; callers run it inside their own transaction."""
+    conn.execute(
+        "INSERT INTO stats(metric, key, value) VALUES(?, ?, ?) "
+        "ON CONFLICT(metric, key) DO UPDATE SET value=value+excluded.value",
+        (metric, key, delta),
+    )
+
+
+def _backfill_stats(conn: sqlite3.Connection):
+    """One-off scan when the stats table is first created; everything after is incremental."""
+    conn.execute(
+        "INSERT INTO stats(metric, key, value) "
+        "SELECT 'subscribers_by_rank', COALESCE(rank_filter, 'Any'), COUNT(*) FROM subscriptions GROUP BY 1, 2"
+    )
+    conn.execute(
+        "INSERT INTO stats(metric, key, value) "
+        "SELECT 'subscribers_by_mode', delivery_mode, COUNT(*) FROM subscriptions GROUP BY 1, 2"
+    )
+    conn.execute(
+        "INSERT INTO stats(metric, key, value) "
+        "SELECT 'notifications', 'sent', COUNT(*) FROM outbox WHERE sent_at IS NOT NULL"
+    )
+    conn.execute(
+        "INSERT INTO stats(metric, key, value) "
+        "SELECT 'notifications', 'failed', COUNT(*) FROM outbox WHERE failed_at IS NOT NULL"
+    )
+    # same rule as publish_vacancy: a duplicate had an earlier row with its
+    # fingerprint from another source. Rank of earlier vacancies was never
+    # stored, so vacancies_by_rank starts empty.
+    conn.execute(
+        """
+        INSERT INTO stats(metric, key, value)
+        SELECT 'vacancies',
+            CASE WHEN EXISTS (
+                SELECT 1 FROM seen_source_vacancies o
+                WHERE o.fingerprint=s.fingerprint AND o.source<>s.source
+                  AND (o.first_seen_at<s.first_seen_at OR (o.first_seen_at=s.first_seen_at AND o.rowid<s.rowid))
+            ) THEN 'duplicate' ELSE 'published' END,
+            COUNT(*)
+        FROM seen_source_vacancies s GROUP BY 1, 2
+        """
+    )
+
+
+def stats_snapshot() -> list[tuple[str, str, int]]:
+    """(metric, key, value) rows, largest first within each metric."""
+    conn = db()
+    rows = conn.execute(
+        "SELECT metric, key, value FROM stats WHERE value<>0 ORDER BY metric, value DESC, key"
+    ).fetchall()
+    return rows
@@ -0,0 +1,207 @@
+# webhook.py
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+log = logging.getLogger("crewbot.webhook")
+
+MAX_BODY_BYTES = 1024 * 1024
+_UNLIMITED = 2**31 - 1  # BaseUpdateProcessor's own limit, see ChatOrderedUpdateProcessor
+
+
+# ---------------- UPDATE PROCESSING ----------------
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to max_concurrent_updates updates at once, but never two
+    updates of the same chat: those run one after another in arrival order.
+    Updates without a chat (e.g. poll answers) only share the global limit.
+
+    The limit is our own semaphore, taken after the chat's lock: the base
+    class's semaphore is taken before do_process_update, so a chat with
+    queued updates would hold every slot while they waited on each other.
+    The base one is made large enough never to block.
+    """
+
+    __slots__ = ("_chats", "_slots")
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        super().__init__(_UNLIMITED)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats: dict[int, list] = {}  # chat_id -> [lock, users]
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._chats.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters FIFO, so per-chat order is kept
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# ---------------- HTTP SERVER ----------------
+class WebhookServer:
+    """
+    Minimal HTTP/1.1 server for Telegram webhook calls: checks the secret
+    token header and puts the update on application.update_queue, where
+    the application's update processor picks it up.
+    GET /healthz answers 200 for load balancer checks.
+    """
+
+    def __init__(self, application: Application, path: str, secret: str):
+        self.application = application
+        self.path = path
+        self.secret = secret.encode("utf-8")
+        self.server: asyncio.AbstractServer | None = None
+        self.connections: set[asyncio.Task] = set()
+
+    async def start(self, host: str, port: int):
+        self.server = await asyncio.start_server(self._handle, host, port)
+
+    async def close(self):
+        """Stops accepting updates; Telegram re-delivers anything not yet acknowledged."""
+        if self.server is None:
+            return
+        self.server.close()
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        self.server = None
+
+    def _route(self, method: str, target: str, headers: dict[str, str], body: bytes) -> int:
+        target = target.split("?", 1)[0]
+        if method == "GET" and target == "/healthz":
+            return 200
+        if method != "POST" or target != self.path:
+            return 404
+
+        token = headers.get("x-telegram-bot-api-secret-token", "").encode("utf-8")
+        if not hmac.compare_digest(token, self.secret):
+            return 403
+
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                return 400
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return 400
+        if update is None:
+            return 400
+        self.application.update_queue.put_nowait(update)
+        return 200
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers: dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = line.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    status = 413
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status = self._route(method, target, headers, body)
+                    keep_alive = headers.get("connection", "").lower() != "close"
+
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    "Content-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # close(): idle keep-alive connection, end quietly
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+
+# ---------------- RUN ----------------
+async def run_webhook(
+    application: Application,
+    url: str,
+    listen: str,
+    port: int,
+    path: str,
+    secret: str,
+    max_connections: int = 40,
+):
+    """
+    Serves updates from Telegram's webhook until SIGTERM/SIGINT, then stops
+    accepting new ones and lets the application finish everything already
+    queued before shutting down. Mirrors run_polling's post_init/post_shutdown.
+    max_connections is how many requests Telegram sends at once (1-100),
+    normally the update processor's concurrency.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = WebhookServer(application, path, secret)
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start(listen, port)
+        await application.start()
+        await application.bot.set_webhook(
+            url=url.rstrip("/") + path,
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=min(max(max_connections, 1), 100),
+        )
+        log.info("webhook listening on %s:%s%s", listen, port, path)
+
+        await stop.wait()
+
+        await server.close()
+        # Application.stop() waits for the update queue and running handlers
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)